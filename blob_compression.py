@@ -0,0 +1,136 @@
+import os
+import zlib
+from azure.storage.blob import ContentSettings
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# zstd is optional; without the package uploads fall back to gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content-Encoding applied to new uploads: gzip, zstd or identity
+upload_encoding = os.getenv("BLOB_CONTENT_ENCODING", "gzip").lower()
+if upload_encoding == "zstd" and zstandard is None:
+    print("zstandard is not installed, compressing uploads with gzip instead.")
+    upload_encoding = "gzip"
+
+content_types = {
+    ".csv": "text/csv; charset=utf-8",
+    ".json": "application/x-ndjson; charset=utf-8",
+    ".txt": "text/plain; charset=utf-8",
+}
+
+
+# Function to guess the content type of an artifact from its file name
+def content_type_for(file_name):
+    return content_types.get(os.path.splitext(file_name)[1].lower(), "application/octet-stream")
+
+
+# Function to get a streaming compressor (compress/flush interface) for an encoding
+def compressor_for(encoding):
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+# Function to get a streaming decompressor (decompress interface) for an encoding
+def decompressor_for(encoding):
+    if encoding == "gzip":
+        return zlib.decompressobj(47)  # Accepts gzip and zlib headers
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Blob is zstd-compressed but zstandard is not installed.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+# Function to compress a whole payload
+def compress(data, encoding):
+    compressor = compressor_for(encoding)
+    if compressor is None:
+        return data
+    return compressor.compress(data) + compressor.flush()
+
+
+# Function to get the Content-Encoding a blob was stored with
+def stored_encoding(properties):
+    encoding = properties.content_settings.content_encoding
+    return encoding.lower() if encoding else "identity"
+
+
+# Function to upload text compressed with the configured encoding
+def upload_text(blob_client, file_name, file_content):
+    data = file_content.encode("utf-8") if isinstance(file_content, str) else file_content
+    content_settings = ContentSettings(
+        content_type=content_type_for(file_name),
+        content_encoding=None if upload_encoding == "identity" else upload_encoding,
+    )
+    blob_client.upload_blob(compress(data, upload_encoding), overwrite=True, content_settings=content_settings)
+
+
+# Function to yield the decompressed byte chunks of a blob download
+def iter_decompressed_chunks(download_stream):
+    decompressor = decompressor_for(stored_encoding(download_stream.properties))
+    for chunk in download_stream.chunks():
+        if decompressor is None:
+            yield chunk
+        else:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+    if decompressor is not None and hasattr(decompressor, "flush"):
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+# Function to download a blob as text whatever encoding it was stored with
+def download_text(blob_client):
+    download_stream = blob_client.download_blob(decompress=False)
+    return b"".join(iter_decompressed_chunks(download_stream)).decode("utf-8")
+
+
+# Function to pick the response encoding from an Accept-Encoding header
+def negotiate_encoding(accept_encoding, stored):
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        name, params = name.strip(), params.strip()
+        quality = 1.0
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+
+    # Stored bytes go out as they are when the client accepts them
+    if stored != "identity" and accepted.get(stored, accepted.get("*", 0)) > 0:
+        return stored
+    for encoding in ("zstd", "gzip") if zstandard is not None else ("gzip",):
+        if accepted.get(encoding, 0) > 0:
+            return encoding
+    return "identity"
+
+
+# Function to yield a blob's bytes re-encoded for the response encoding
+def iter_response_chunks(download_stream, stored, response_encoding):
+    if stored == response_encoding:
+        yield from download_stream.chunks()
+        return
+    compressor = compressor_for(response_encoding)
+    for chunk in iter_decompressed_chunks(download_stream):
+        if compressor is None:
+            yield chunk
+        else:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,160 @@
+import os
+import queue
+import atexit
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Rendering is off unless enabled, since it needs Chrome on the host
+rendering_enabled = os.getenv("JS_RENDERING", "false").lower() in ("1", "true", "yes")
+
+# Warm browsers kept per process
+pool_size = int(os.getenv("BROWSER_POOL_SIZE", 2))
+
+page_timeout = float(os.getenv("BROWSER_PAGE_TIMEOUT_SECONDS", 30))
+
+# Browsers are relaunched after this many pages to bound their memory growth
+max_pages_per_browser = int(os.getenv("BROWSER_MAX_PAGES", 200))
+
+# Requests the browsers never make: images, fonts and media
+blocked_extensions = [
+    "png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico",
+    "woff", "woff2", "ttf", "otf", "eot",
+    "mp4", "webm", "mp3", "m4a", "ogg", "wav", "avi", "mov",
+]
+
+# Patterns match the full URL, so each extension is also blocked when a query string
+# follows it (font.woff2?v=4.7.0, img.jpg?w=800)
+blocked_url_patterns = [pattern for extension in blocked_extensions for pattern in (f"*.{extension}", f"*.{extension}?*")]
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+# Function to get the chromedriver path, downloading it once per process
+def driver_path():
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            from webdriver_manager.chrome import ChromeDriverManager
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+
+# Function to launch one headless Chrome with heavy resources blocked
+def launch_browser():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.media_stream": 2,
+    })
+    options.page_load_strategy = "eager"  # Return at DOMContentLoaded, not after every subresource
+
+    driver = webdriver.Chrome(service=Service(driver_path()), options=options)
+    driver.set_page_load_timeout(page_timeout)
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_url_patterns})
+    return driver
+
+
+class PooledBrowser:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+class BrowserPool:
+    def __init__(self, size):
+        self.size = size
+        self.idle = queue.Queue()
+        self.launched = 0
+        self.lock = threading.Lock()
+
+    # Function to take a warm browser, launching one while the pool is below its size
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            launch = self.launched < self.size
+            if launch:
+                self.launched += 1
+        if launch:
+            try:
+                return PooledBrowser(launch_browser())
+            except Exception:
+                with self.lock:
+                    self.launched -= 1
+                raise
+        return self.idle.get(timeout=page_timeout * 2)
+
+    # Function to return a browser to the pool, or retire it if it is broken or worn out
+    def release(self, browser, healthy):
+        if healthy and browser.pages < max_pages_per_browser:
+            self.idle.put(browser)
+            return
+        try:
+            browser.driver.quit()
+        except Exception:
+            pass
+        with self.lock:
+            self.launched -= 1
+
+    # Function to load a page in a warm browser and return the rendered HTML
+    def render(self, url, wait_selector=None):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+
+        browser = self.acquire()
+        healthy = True
+        try:
+            browser.driver.get(url)
+            browser.pages += 1
+            if wait_selector:
+                try:
+                    WebDriverWait(browser.driver, page_timeout).until(
+                        expected_conditions.presence_of_element_located((By.CSS_SELECTOR, wait_selector)))
+                except TimeoutException:
+                    print(f"Rendered {url} without finding {wait_selector}.")
+            return browser.driver.page_source
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            # Leave the tab blank so the next page starts clean
+            if healthy:
+                try:
+                    browser.driver.get("about:blank")
+                except Exception:
+                    healthy = False
+            self.release(browser, healthy)
+
+    # Function to quit every idle browser
+    def close(self):
+        while True:
+            try:
+                browser = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.release(browser, healthy=False)
+
+
+pool = BrowserPool(pool_size)
+atexit.register(pool.close)
+
+
+# Function to render a JavaScript page with the shared pool
+def render_page(url, wait_selector=None):
+    return pool.render(url, wait_selector)
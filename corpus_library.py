@@ -0,0 +1,318 @@
+import os
+import json
+import fcntl
+import re
+import uuid
+import shutil
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+import scipy.sparse as sp
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from unique_content import blob_service_client, iter_csv_chunks, hashing_vectorizer, BlockBlobWriter
+from duplicate_clusters import dedup_suffix
+
+app = FastAPI()
+
+# Local directory holding the persisted library
+library_dir = os.getenv("CORPUS_LIBRARY_DIR", "CorpusLibrary")
+manifest_path = os.path.join(library_dir, "manifest.json")
+doc_freq_path = os.path.join(library_dir, "doc_freq.npy")
+lock_path = os.path.join(library_dir, "library.lock")
+
+# Status of each comparison job, shared by the workers through the library folder
+jobs_dir = os.path.join(library_dir, "jobs")
+
+# Container the reference corpora are read from
+savecsv_container = "savecsv"
+
+
+# Lock shared by all workers: queries read concurrently, updates are exclusive
+@contextmanager
+def library_lock(exclusive):
+    os.makedirs(library_dir, exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Function to load the manifest and document frequencies of the library
+def load_library():
+    if not os.path.exists(manifest_path):
+        return {"sources": {}, "n_docs": 0}, np.zeros(hashing_vectorizer.n_features, dtype=np.int64)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return manifest, np.load(doc_freq_path)
+
+
+# Function to persist the manifest and document frequencies atomically
+def save_library(manifest, doc_freq):
+    np.save(doc_freq_path + ".tmp.npy", doc_freq)
+    os.replace(doc_freq_path + ".tmp.npy", doc_freq_path)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+# Function to compute the document frequencies contributed by a stored source
+def source_doc_freq(source):
+    doc_freq = np.zeros(hashing_vectorizer.n_features, dtype=np.int64)
+    for shard in source["shards"]:
+        counts = sp.load_npz(os.path.join(library_dir, shard + ".npz"))
+        doc_freq += np.bincount(counts.indices, minlength=hashing_vectorizer.n_features)
+    return doc_freq
+
+
+# Function to drop a source from the library (caller holds the exclusive lock)
+def remove_source_locked(manifest, doc_freq, file_name):
+    source = manifest["sources"].pop(file_name, None)
+    if source is None:
+        return False
+    doc_freq -= source_doc_freq(source)
+    manifest["n_docs"] -= source["rows"]
+    shutil.rmtree(os.path.join(library_dir, source["folder"]), ignore_errors=True)
+    return True
+
+
+# Function to add or replace one reference corpus without touching the others
+def add_source(file_name, etag=None):
+    if etag is None:
+        blob_client = blob_service_client.get_blob_client(container=savecsv_container, blob=file_name)
+        etag = blob_client.get_blob_properties().etag
+
+    folder = os.path.join("sources", hashlib.sha1(f"{file_name}|{etag}".encode()).hexdigest())
+    with library_lock(exclusive=False):
+        manifest, _ = load_library()
+    stored = manifest["sources"].get(file_name)
+    if stored is not None and stored["folder"] == folder:
+        return stored  # This version is already in the library
+
+    # Vectorize into a private folder outside the lock; readers never see partial shards
+    tmp_folder = f"{folder}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(library_dir, tmp_folder))
+    try:
+        shards = []
+        rows = 0
+        for n, df in enumerate(iter_csv_chunks(savecsv_container, file_name)):
+            sp.save_npz(os.path.join(library_dir, tmp_folder, f"chunk-{n}.npz"), hashing_vectorizer.transform(df['Processed_Text']))
+            with open(os.path.join(library_dir, tmp_folder, f"chunk-{n}.titles.json"), "w") as f:
+                json.dump(df['Title'].fillna('').astype(str).tolist(), f)
+            shards.append(os.path.join(folder, f"chunk-{n}"))
+            rows += len(df)
+        source = {"etag": etag, "rows": rows, "folder": folder, "shards": shards}
+
+        # Only the folder and manifest swap is exclusive
+        with library_lock(exclusive=True):
+            manifest, doc_freq = load_library()
+            stored = manifest["sources"].get(file_name)
+            if stored is not None and stored["folder"] == folder:
+                return stored  # Same version stored by another worker meanwhile
+            # A folder left by an interrupted add is not in the manifest, so nobody reads it
+            shutil.rmtree(os.path.join(library_dir, folder), ignore_errors=True)
+            os.replace(os.path.join(library_dir, tmp_folder), os.path.join(library_dir, folder))
+            remove_source_locked(manifest, doc_freq, file_name)
+            manifest["sources"][file_name] = source
+            manifest["n_docs"] += rows
+            doc_freq += source_doc_freq(source)
+            save_library(manifest, doc_freq)
+    finally:
+        shutil.rmtree(os.path.join(library_dir, tmp_folder), ignore_errors=True)
+
+    print(f"Library source {file_name} stored ({rows} rows).")
+    return source
+
+
+# Function to remove one reference corpus from the library
+def remove_source(file_name):
+    with library_lock(exclusive=True):
+        manifest, doc_freq = load_library()
+        removed = remove_source_locked(manifest, doc_freq, file_name)
+        if removed:
+            save_library(manifest, doc_freq)
+    return removed
+
+
+# Function to bring the library in line with the savecsv container
+def sync_library():
+    container_client = blob_service_client.get_container_client(savecsv_container)
+    with library_lock(exclusive=False):
+        manifest, _ = load_library()
+
+    # Deduplicated copies would match their originals row for row, so they are not sources
+    current = {}
+    for blob in container_client.list_blobs():
+        if blob.name.endswith(".csv") and not blob.name.endswith(dedup_suffix):
+            current[blob.name] = blob.etag
+
+    for file_name, etag in current.items():
+        if manifest["sources"].get(file_name, {}).get("etag") != etag:
+            try:
+                add_source(file_name, etag)
+            except Exception as e:
+                print(f"Failed to add {file_name} to the library: {e}")
+    for file_name in manifest["sources"]:
+        if file_name not in current:
+            remove_source(file_name)
+    print(f"Library synced with {len(current)} CSV files.")
+
+
+# Function to IDF-weight and L2-normalize hashed term counts
+def weight_rows(counts, idf):
+    X = counts @ sp.diags(idf)
+    norms = np.sqrt(X.multiply(X).sum(axis=1)).A1
+    norms[norms == 0] = 1.0
+    return sp.csr_matrix(sp.diags(1.0 / norms) @ X)
+
+
+# Function to compare a CSV against every source in the library in one pass
+def compare_with_library(file1, threshold, output_csv_path, output_json_path):
+    with library_lock(exclusive=False):
+        manifest, doc_freq = load_library()
+        sources = {name: source for name, source in manifest["sources"].items() if name != file1}
+        if not sources:
+            raise HTTPException(status_code=404, detail="The corpus library has no other sources.")
+
+        idf = np.log((1 + manifest["n_docs"]) / (1 + doc_freq)) + 1
+        idf[doc_freq == 0] = 0
+
+        csv_writer = BlockBlobWriter("unique", output_csv_path)
+        json_writer = BlockBlobWriter("unique", output_json_path)
+        header_written = False
+        unique_count = 0
+        for df1 in iter_csv_chunks(savecsv_container, file1):
+            X_df1 = weight_rows(hashing_vectorizer.transform(df1['Processed_Text']), idf)
+            best_similarity = np.zeros(len(df1))
+            best_source = np.full(len(df1), "", dtype=object)
+            best_title = np.full(len(df1), "", dtype=object)
+
+            for name, source in sources.items():
+                for shard in source["shards"]:
+                    X_ref = weight_rows(sp.load_npz(os.path.join(library_dir, shard + ".npz")), idf)
+                    if X_ref.shape[0] == 0:
+                        continue
+                    similarity = (X_df1 @ X_ref.T).tocsr()
+                    shard_best = similarity.max(axis=1).toarray().ravel()
+                    better = shard_best > best_similarity
+                    if not better.any():
+                        continue
+                    with open(os.path.join(library_dir, shard + ".titles.json")) as f:
+                        titles = json.load(f)
+                    shard_argmax = similarity.argmax(axis=1).A1
+                    best_similarity[better] = shard_best[better]
+                    best_source[better] = name
+                    best_title[better] = [titles[j] for j in shard_argmax[better]]
+
+            result_df = df1.copy()
+            result_df['Is_Unique'] = best_similarity < threshold
+            result_df['Uniqueness_Score'] = 1 - best_similarity
+            result_df['Closest_Source'] = best_source
+            result_df['Closest_Title'] = best_title
+            result_df['Closest_Similarity'] = best_similarity
+            unique_count += int(result_df['Is_Unique'].sum())
+
+            csv_writer.write(result_df.to_csv(index=False, header=not header_written))
+            json_lines = result_df.to_json(orient='records', lines=True)
+            json_writer.write(json_lines if json_lines.endswith("\n") else json_lines + "\n")
+            header_written = True
+
+        csv_writer.close()
+        json_writer.close()
+
+    print(f"Compared {file1} against {len(sources)} library sources: {unique_count} unique rows.")
+    return len(sources), unique_count
+
+
+# Function to read the status of a comparison job, or None if there is none
+def read_job(job_id):
+    try:
+        with open(os.path.join(jobs_dir, f"{job_id}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Function to write the status of a comparison job atomically
+def write_job(job_id, entry):
+    os.makedirs(jobs_dir, exist_ok=True)
+    path = os.path.join(jobs_dir, f"{job_id}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(entry, f)
+    os.replace(path + ".tmp", path)
+
+
+# Function to run a comparison job and record its outcome
+def run_library_job(job_id, entry):
+    try:
+        sources, unique_count = compare_with_library(entry["file1"], entry["threshold"], entry["CSV_FileName"], entry["JSON_FileName"])
+        entry.update(status="done", Sources=sources, Unique_Rows=unique_count)
+    except Exception as e:
+        print(f"Library comparison job {job_id} failed: {e}")
+        entry["status"] = "failed"
+        entry["error"] = str(e.detail if isinstance(e, HTTPException) else e)
+    entry["finished"] = datetime.now(timezone.utc).isoformat()
+    write_job(job_id, entry)
+
+
+@app.get("/sources")
+def list_sources():
+    with library_lock(exclusive=False):
+        manifest, _ = load_library()
+    return {
+        "n_docs": manifest["n_docs"],
+        "sources": {name: {"etag": source["etag"], "rows": source["rows"]} for name, source in manifest["sources"].items()}
+    }
+
+
+@app.post("/sync")
+async def start_sync(background_tasks: BackgroundTasks):
+    background_tasks.add_task(sync_library)
+    return {"status": "Sync started", "message": "The library is being updated from the savecsv container."}
+
+
+@app.post("/sources/{file_name}")
+async def start_add_source(file_name: str, background_tasks: BackgroundTasks):
+    background_tasks.add_task(add_source, file_name)
+    return {"status": "Task started", "message": f"{file_name} is being added to the library."}
+
+
+@app.delete("/sources/{file_name}")
+def delete_source(file_name: str):
+    if not remove_source(file_name):
+        raise HTTPException(status_code=404, detail=f"{file_name} is not in the library.")
+    return {"Message": f"{file_name} removed from the library."}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    entry = read_job(job_id) if re.fullmatch("[0-9a-f]{32}", job_id) else None
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"job_id": job_id, **entry}
+
+
+@app.get("/unique/{file1}")
+def unique_against_library(file1: str, background_tasks: BackgroundTasks, threshold: float = 0.5):
+    with library_lock(exclusive=False):
+        manifest, _ = load_library()
+    if not any(name != file1 for name in manifest["sources"]):
+        raise HTTPException(status_code=404, detail="The corpus library has no other sources.")
+
+    # The comparison reads every source, so it runs in the background
+    job_id = uuid.uuid4().hex
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    entry = {
+        "status": "running",
+        "file1": file1,
+        "threshold": threshold,
+        "CSV_FileName": f'library_unique_{timestamp}_{job_id[:8]}.csv',
+        "JSON_FileName": f'library_unique_{timestamp}_{job_id[:8]}.json',
+        "started": datetime.now(timezone.utc).isoformat()
+    }
+    write_job(job_id, entry)
+    background_tasks.add_task(run_library_job, job_id, entry)
+
+    return {"status": "Task started", "job_id": job_id, "message": f"Poll /corpus_library/jobs/{job_id} for the result."}
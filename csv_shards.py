@@ -0,0 +1,354 @@
+import os
+import io
+import csv
+import time
+import uuid
+import socket
+import sqlite3
+import datetime
+import threading
+from fastapi import FastAPI, HTTPException
+from azure.core.exceptions import ResourceNotFoundError
+from generate_csv import (
+    blob_service_client, savelinks_container, savecsv_container, csv_fieldnames,
+    extract_content, download_file_from_container, upload_file_to_container,
+)
+from blob_compression import download_text
+from webhook_dispatcher import dispatch, webhook_url
+
+app = FastAPI()
+
+# Coordination store shared by every worker on this host. SQLite in WAL mode needs shared
+# memory, so the file must be on a local disk and cannot be shared between machines.
+shard_db_path = os.getenv("CSV_SHARD_DB", "csv_shards.sqlite3")
+
+# A worker that stops renewing its lease for this long loses the shard
+lease_seconds = float(os.getenv("CSV_SHARD_LEASE_SECONDS", 120))
+
+# Links per shard when the request does not say otherwise
+default_shard_size = int(os.getenv("CSV_SHARD_SIZE", 200))
+
+# A shard or merge leased this many times without finishing fails its job
+max_attempts = int(os.getenv("CSV_SHARD_MAX_ATTEMPTS", 3))
+
+# Shard worker threads started per process; 0 disables them
+worker_threads = int(os.getenv("CSV_SHARD_WORKER_THREADS", 1))
+
+# Idle workers poll the store this often
+poll_seconds = float(os.getenv("CSV_SHARD_POLL_SECONDS", 2))
+
+# Partial outputs live next to the final CSV; the suffix keeps them out of CSV listings
+partial_prefix = "_shards/"
+
+_workers_started = False
+_workers_lock = threading.Lock()
+
+
+# Function to open the coordination store, creating the tables on first use
+def connect():
+    conn = sqlite3.connect(shard_db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            file TEXT NOT NULL,
+            ref_link_id TEXT,
+            csv_file_name TEXT NOT NULL,
+            n_shards INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created REAL NOT NULL
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shards (
+            job_id TEXT NOT NULL,
+            shard_no INTEGER NOT NULL,
+            links TEXT NOT NULL,
+            status TEXT NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            rows_written INTEGER,
+            PRIMARY KEY (job_id, shard_no)
+        )""")
+    return conn
+
+
+# Function to split a link file into shards and register the job
+def create_job(file, ref_link_id, shard_size):
+    link_file_content = download_file_from_container(savelinks_container, file)
+    formatted_links = [link for link in link_file_content.splitlines() if link.strip()]
+    if not formatted_links:
+        raise HTTPException(status_code=400, detail="The link file is empty.")
+
+    job_id = uuid.uuid4().hex
+    timestamp = int(datetime.datetime.now().timestamp())
+    csv_file_name = f"{os.path.splitext(file)[0]}-{timestamp}.csv"
+    shards = [formatted_links[start:start + shard_size] for start in range(0, len(formatted_links), shard_size)]
+
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO jobs (job_id, file, ref_link_id, csv_file_name, n_shards, status, created) VALUES (?, ?, ?, ?, ?, 'running', ?)",
+            (job_id, file, ref_link_id, csv_file_name, len(shards), time.time()))
+        conn.executemany(
+            "INSERT INTO shards (job_id, shard_no, links, status) VALUES (?, ?, ?, 'pending')",
+            [(job_id, shard_no, "\n".join(links)) for shard_no, links in enumerate(shards)])
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    print(f"Job {job_id}: {len(formatted_links)} links split into {len(shards)} shards.")
+    return job_id, len(shards), csv_file_name
+
+
+# Function to mark a job failed inside the caller's transaction; True if this call failed it
+def fail_job(conn, job_id, error):
+    cursor = conn.execute(
+        "UPDATE jobs SET status = 'failed', error = ? WHERE job_id = ? AND status IN ('running', 'merging')", (error, job_id))
+    return cursor.rowcount == 1
+
+
+# Function to send the error notification of a failed job
+def notify_job_failed(conn, job_id):
+    job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    payload = {
+        "error": job["error"],
+        "refLinkId": job["ref_link_id"],
+        "refFileName": job["file"]
+    }
+    dispatch(webhook_url("/api/webhook/saveCSVfile"), payload)
+    print(f"Job {job_id} failed: {job['error']}")
+    delete_partials(job_id, job["n_shards"])
+
+
+# Function to lease the next pending shard, or one whose lease has expired.
+# A shard that has used up its attempts fails its job instead; the second value is that job's id.
+def lease_shard(conn, worker_id):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """SELECT s.job_id, s.shard_no, s.links, s.attempts FROM shards s JOIN jobs j ON j.job_id = s.job_id
+               WHERE j.status = 'running' AND (s.status = 'pending' OR (s.status = 'leased' AND s.lease_expires < ?))
+               ORDER BY j.created, s.shard_no LIMIT 1""", (now,)).fetchone()
+        failed_job_id = None
+        if row is not None and row["attempts"] >= max_attempts:
+            conn.execute(
+                "UPDATE shards SET status = 'failed', worker = NULL WHERE job_id = ? AND shard_no = ?", (row["job_id"], row["shard_no"]))
+            if fail_job(conn, row["job_id"], f"Shard {row['shard_no']} did not finish after {row['attempts']} attempts."):
+                failed_job_id = row["job_id"]
+            row = None
+        elif row is not None:
+            conn.execute(
+                "UPDATE shards SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE job_id = ? AND shard_no = ?",
+                (worker_id, now + lease_seconds, row["job_id"], row["shard_no"]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row, failed_job_id
+
+
+# Function to lease the merge of a job whose shards are all done.
+# A merge that has used up its attempts fails the job instead; the second value is that job's id.
+def lease_merge(conn, worker_id):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """SELECT j.job_id, j.attempts FROM jobs j
+               WHERE (j.status = 'running' OR (j.status = 'merging' AND j.lease_expires < ?))
+               AND NOT EXISTS (SELECT 1 FROM shards s WHERE s.job_id = j.job_id AND s.status != 'done')
+               ORDER BY j.created LIMIT 1""", (now,)).fetchone()
+        failed_job_id = None
+        if row is not None and row["attempts"] >= max_attempts:
+            if fail_job(conn, row["job_id"], f"Merge did not finish after {row['attempts']} attempts."):
+                failed_job_id = row["job_id"]
+            row = None
+        elif row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'merging', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE job_id = ?",
+                (worker_id, now + lease_seconds, row["job_id"]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row, failed_job_id
+
+
+# Function to extend a shard lease; False means another worker has taken the shard over
+def renew_shard_lease(conn, worker_id, job_id, shard_no):
+    cursor = conn.execute(
+        "UPDATE shards SET lease_expires = ? WHERE job_id = ? AND shard_no = ? AND worker = ? AND status = 'leased'",
+        (time.time() + lease_seconds, job_id, shard_no, worker_id))
+    return cursor.rowcount == 1
+
+
+# Function to extend a merge lease; False means another worker has taken the merge over
+def renew_merge_lease(conn, worker_id, job_id):
+    cursor = conn.execute(
+        "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND worker = ? AND status = 'merging'",
+        (time.time() + lease_seconds, job_id, worker_id))
+    return cursor.rowcount == 1
+
+
+# Function to get the blob name of a shard's partial output
+def partial_name(job_id, shard_no):
+    return f"{partial_prefix}{job_id}/{shard_no:06d}.csv.part"
+
+
+# Function to extract the links of one shard and upload its partial CSV
+def process_shard(conn, worker_id, job_id, shard_no, links):
+    all_data = []
+    for url in links.splitlines():
+        try:
+            data = extract_content(url)
+            if data is not None:
+                all_data.append(data)
+        except Exception as e:
+            print(f"Error processing {url}: {e}")
+        if not renew_shard_lease(conn, worker_id, job_id, shard_no):
+            print(f"Lost the lease on shard {shard_no} of job {job_id}, abandoning it.")
+            return
+
+    csv_file = io.StringIO()
+    writer = csv.DictWriter(csv_file, fieldnames=csv_fieldnames)
+    writer.writeheader()
+    writer.writerows(all_data)
+    upload_file_to_container(savecsv_container, partial_name(job_id, shard_no), csv_file.getvalue())
+
+    conn.execute(
+        "UPDATE shards SET status = 'done', rows_written = ? WHERE job_id = ? AND shard_no = ? AND worker = ? AND status = 'leased'",
+        (len(all_data), job_id, shard_no, worker_id))
+    print(f"Shard {shard_no} of job {job_id} done: {len(all_data)} rows.")
+
+
+# Function to delete the partial outputs of a job
+def delete_partials(job_id, n_shards):
+    container_client = blob_service_client.get_container_client(savecsv_container)
+    for shard_no in range(n_shards):
+        try:
+            container_client.delete_blob(partial_name(job_id, shard_no))
+        except ResourceNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error deleting partial {shard_no} of job {job_id}: {e}")
+
+
+# Function to merge the partial outputs of a job into one CSV in shard order
+def merge_job(conn, worker_id, job_id):
+    job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    container_client = blob_service_client.get_container_client(savecsv_container)
+
+    csv_file = io.StringIO()
+    writer = csv.writer(csv_file)
+    writer.writerow(csv_fieldnames)
+    for shard_no in range(job["n_shards"]):
+        partial = download_text(container_client.get_blob_client(partial_name(job_id, shard_no)))
+        rows = csv.reader(io.StringIO(partial))
+        next(rows, None)  # Header of the partial file
+        writer.writerows(rows)
+        # Renewing after each partial also covers the upload that follows the last one
+        if not renew_merge_lease(conn, worker_id, job_id):
+            print(f"Lost the lease on the merge of job {job_id}, abandoning it.")
+            return
+    upload_file_to_container(savecsv_container, job["csv_file_name"], csv_file.getvalue())
+
+    cursor = conn.execute(
+        "UPDATE jobs SET status = 'done' WHERE job_id = ? AND worker = ? AND status = 'merging'", (job_id, worker_id))
+    if cursor.rowcount != 1:
+        return  # Another worker took the merge over after our lease expired
+
+    delete_partials(job_id, job["n_shards"])
+
+    # Same notification as the single-worker generate_csv
+    payload = {
+        "Message": "Data extraction and storage complete.",
+        "fileName": job["csv_file_name"],
+        "refLinkId": job["ref_link_id"],
+        "refFileName": job["file"]
+    }
+    dispatch(webhook_url("/api/webhook/saveCSVfile"), payload)
+    print(f"Job {job_id} merged into {job['csv_file_name']}.")
+
+
+# Function run by each worker thread: merge finished jobs, otherwise work on a shard
+def worker_loop(worker_id):
+    conn = connect()
+    print(f"Shard worker {worker_id} started.")
+    while True:
+        try:
+            job, failed_job_id = lease_merge(conn, worker_id)
+            if failed_job_id is not None:
+                notify_job_failed(conn, failed_job_id)
+                continue
+            if job is not None:
+                merge_job(conn, worker_id, job["job_id"])
+                continue
+            shard, failed_job_id = lease_shard(conn, worker_id)
+            if failed_job_id is not None:
+                notify_job_failed(conn, failed_job_id)
+                continue
+            if shard is not None:
+                process_shard(conn, worker_id, shard["job_id"], shard["shard_no"], shard["links"])
+                continue
+        except Exception as e:
+            print(f"Shard worker {worker_id} error: {e}")
+        time.sleep(poll_seconds)
+
+
+# Function to start this process's shard workers (called once per gunicorn worker)
+def start_workers(threads=worker_threads):
+    global _workers_started
+    with _workers_lock:
+        if _workers_started or threads < 1:
+            return
+        _workers_started = True
+        for n in range(threads):
+            worker_id = f"{socket.gethostname()}-{os.getpid()}-{n}"
+            threading.Thread(target=worker_loop, args=(worker_id,), name=f"csv-shard-worker-{n}", daemon=True).start()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    conn = connect()
+    try:
+        job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found.")
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM shards WHERE job_id = ? GROUP BY status", (job_id,)).fetchall())
+        rows_written = conn.execute("SELECT COALESCE(SUM(rows_written), 0) FROM shards WHERE job_id = ?", (job_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "error": job["error"],
+        "fileName": job["csv_file_name"],
+        "total_shards": job["n_shards"],
+        "shards": counts,
+        "csv_rows_written": rows_written
+    }
+
+
+@app.get("/{file}")
+def start_sharded_csv_generation(file: str, refLinkId: str, shard_size: int = default_shard_size):
+    if shard_size < 1:
+        raise HTTPException(status_code=400, detail="shard_size must be positive.")
+    job_id, n_shards, csv_file_name = create_job(file, refLinkId, shard_size)
+    start_workers()
+    return {"status": "Task started", "job_id": job_id, "shards": n_shards, "fileName": csv_file_name}
+
+
+# Run extra shard workers on the same host as the app: python csv_shards.py [threads]
+if __name__ == "__main__":
+    import sys
+    start_workers(int(sys.argv[1]) if len(sys.argv) > 1 else max(worker_threads, 1))
+    while True:
+        time.sleep(3600)
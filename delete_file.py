@@ -1,8 +1,32 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from azure.storage.blob import BlobServiceClient
+from dotenv import load_dotenv
+from unique_content import cache_prefix
+from csv_shards import partial_prefix
 import os
 
 app = FastAPI()
+load_dotenv()
+
+# Azure Storage connection string
+connect_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+blob_service_client = BlobServiceClient.from_connection_string(connect_str)
+
+# Blob container cleaned for each list of kept files
+blob_containers = {"link": "savelinks", "CSV": "savecsv", "Unique": "unique"}
+
+# Azure accepts at most 256 sub-requests per batch
+delete_batch_size = 256
+
+# Names listed in the report of each container
+report_sample_size = 20
+
+# Blobs the app manages itself, never cleaned: unique_content cache entries and in-flight csv_shards partials
+internal_prefixes = (cache_prefix, partial_prefix)
 
 
 # Define the request body model
@@ -48,6 +72,95 @@ def delete_unwanted_Uniquefiles(keep_files, directory='uniqueFolder'):
                 print(f"Error deleting {file_name}: {e}")
 
 
+# Function to delete one batch of blobs, returning (deleted, failed) counts
+def delete_blob_batch(container_client, names):
+    deleted = failed = 0
+    try:
+        for response in container_client.delete_blobs(*names, raise_on_any_failure=False):
+            if response.status_code in (202, 404):  # Already gone counts as deleted
+                deleted += 1
+            else:
+                failed += 1
+    except Exception as e:
+        print(f"Error deleting batch of {len(names)} blobs: {e}")
+        failed += len(names)
+    return deleted, failed
+
+
+# Function to delete every blob of a container outside the keep-set
+def cleanup_container(container_name, keep_files, prefix="", dry_run=True, min_age_days=None, max_total_mb=None, max_concurrency=8):
+    container_client = blob_service_client.get_container_client(container_name)
+    keep_files = set(keep_files)
+    now = datetime.now(timezone.utc)
+    report = {"container": container_name, "scanned": 0, "kept": 0, "deleted": 0, "failed": 0, "bytes": 0, "sample": []}
+
+    # Function to pick the deletable blobs of one listing page
+    def candidates_in(page):
+        candidates = []
+        for blob in page:
+            report["scanned"] += 1
+            too_new = min_age_days is not None and now - blob.last_modified < timedelta(days=min_age_days)
+            if blob.name in keep_files or blob.name.startswith(internal_prefixes) or too_new:
+                report["kept"] += 1
+            else:
+                candidates.append(blob)
+        return candidates
+
+    def delete(blobs, executor, futures):
+        report["bytes"] += sum(blob.size for blob in blobs)
+        report["sample"].extend(blob.name for blob in blobs[:report_sample_size - len(report["sample"])])
+        if dry_run:
+            report["deleted"] += len(blobs)
+            return
+        names = [blob.name for blob in blobs]
+        for start in range(0, len(names), delete_batch_size):
+            futures.append(executor.submit(delete_blob_batch, container_client, names[start:start + delete_batch_size]))
+
+    pages = container_client.list_blobs(name_starts_with=prefix or None, results_per_page=5000).by_page()
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        if max_total_mb is None:
+            # Delete page by page while the listing continues
+            for page in pages:
+                delete(candidates_in(page), executor, futures)
+        else:
+            # Size budget: keep the newest blobs up to the first that overflows it, delete that one and everything older
+            candidates = [blob for page in pages for blob in candidates_in(page)]
+            candidates.sort(key=lambda blob: blob.last_modified, reverse=True)
+            budget = max_total_mb * 1024 * 1024
+            kept = 0
+            while kept < len(candidates) and candidates[kept].size <= budget:
+                budget -= candidates[kept].size
+                kept += 1
+            report["kept"] += kept
+            delete(candidates[kept:], executor, futures)
+
+        for future in futures:
+            deleted, failed = future.result()
+            report["deleted"] += deleted
+            report["failed"] += failed
+
+    print(f"Cleanup of {container_name}: {report['deleted']} {'would be ' if dry_run else ''}deleted, {report['kept']} kept, {report['failed']} failed.")
+    return report
+
+
+@app.post("/blobs")
+def cleanup_blobs(file_names: FileNames, dry_run: bool = True, prefix: str = "", min_age_days: Optional[float] = None, max_total_mb: Optional[float] = None, max_concurrency: int = 8):
+    if max_concurrency < 1 or max_concurrency > 32:
+        raise HTTPException(status_code=400, detail="max_concurrency must be between 1 and 32.")
+
+    # Only reports what would be deleted unless called with dry_run=false
+    reports = []
+    for field, container_name in blob_containers.items():
+        reports.append(cleanup_container(container_name, getattr(file_names, field), prefix, dry_run, min_age_days, max_total_mb, max_concurrency))
+
+    return {
+        "Message": "Dry run complete" if dry_run else "Blobs deleted successfully",
+        "DryRun": dry_run,
+        "Containers": reports
+    }
+
+
 @app.post("/")
 async def read_root(file_names: FileNames):
     # Call the deletion functions with the received file names
@@ -0,0 +1,135 @@
+import os
+import io
+import uuid
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from fastapi import FastAPI, HTTPException
+from sklearn.feature_extraction.text import TfidfVectorizer
+from unique_content import preprocess_text, download_file_from_container, upload_file_to_container
+
+app = FastAPI()
+
+# Rarest shared terms used as blocking keys per row
+block_terms_per_row = int(os.getenv("DUPLICATE_BLOCK_TERMS", 4))
+
+# Terms shared by more rows than this are too common to block on
+max_block_size = int(os.getenv("DUPLICATE_MAX_BLOCK_SIZE", 200))
+
+# Canonical links that carry no information
+missing_links = {"", "no link", "N/A"}
+
+# Deduplicated copies are saved as <file>-dedup.csv; the corpus library skips them
+dedup_suffix = "-dedup.csv"
+
+
+# Union-find over row positions
+class DisjointSet:
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+# Function to group row positions by their rarest shared terms
+def candidate_blocks(X):
+    doc_freq = np.bincount(X.indices, minlength=X.shape[1])
+    blocks = {}
+    for row in range(X.shape[0]):
+        terms = X.indices[X.indptr[row]:X.indptr[row + 1]]
+        terms = terms[(doc_freq[terms] >= 2) & (doc_freq[terms] <= max_block_size)]
+        for term in terms[np.argsort(doc_freq[terms], kind="stable")[:block_terms_per_row]]:
+            blocks.setdefault(term, []).append(row)
+    return [rows for rows in blocks.values() if len(rows) > 1]
+
+
+# Function to cluster near-duplicate rows, adding Cluster_ID, Cluster_Size and Is_Representative
+def cluster_duplicates(df, threshold):
+    texts = (df['Title'].fillna('') + ' ' + df['Meta Description'].fillna('') + ' ' + df['Article Content'].fillna('')).apply(preprocess_text)
+    try:
+        X = TfidfVectorizer().fit_transform(texts).tocsr()
+    except ValueError:
+        # No rows, or only stopwords: nothing to compare but canonical links
+        X = sp.csr_matrix((len(df), 0))
+    clusters = DisjointSet(len(df))
+
+    # Rows claiming the same canonical link are the same article
+    first_row = {}
+    for row, link in enumerate(df['Canonical Link'].fillna('').astype(str).str.strip()):
+        if link in missing_links:
+            continue
+        if link in first_row:
+            clusters.union(first_row[link], row)
+        else:
+            first_row[link] = row
+
+    # Sparse similarity only within each block
+    blocks = candidate_blocks(X)
+    for rows in blocks:
+        rows = np.array(rows)
+        similarity = (X[rows] @ X[rows].T).tocoo()
+        for i, j, value in zip(similarity.row, similarity.col, similarity.data):
+            if i < j and value >= threshold:
+                clusters.union(rows[i], rows[j])
+    print(f"Compared {len(df)} rows within {len(blocks)} candidate blocks.")
+
+    roots = np.array([clusters.find(i) for i in range(len(df))])
+    _, cluster_ids, cluster_sizes = np.unique(roots, return_inverse=True, return_counts=True)
+    result_df = df.copy()
+    result_df['Cluster_ID'] = cluster_ids
+    result_df['Cluster_Size'] = cluster_sizes[cluster_ids]
+
+    # The most complete article of each cluster represents it, earliest row on ties
+    content_length = df['Article Content'].fillna('').astype(str).str.len().to_numpy()
+    order = np.lexsort((np.arange(len(df)), -content_length, cluster_ids))
+    first_in_cluster = np.ones(len(df), dtype=bool)
+    first_in_cluster[1:] = cluster_ids[order][1:] != cluster_ids[order][:-1]
+    is_representative = np.zeros(len(df), dtype=bool)
+    is_representative[order[first_in_cluster]] = True
+    result_df['Is_Representative'] = is_representative
+    return result_df
+
+
+@app.get("/{file1}")
+def find_duplicate_clusters(file1: str, threshold: float = 0.8, dedup: bool = False):
+    if not 0 < threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold must be in (0, 1].")
+
+    csv_content = download_file_from_container("savecsv", file1)
+    try:
+        df = pd.read_csv(io.StringIO(csv_content))
+    except pd.errors.EmptyDataError:
+        raise HTTPException(status_code=400, detail="The CSV file is empty.")
+    result_df = cluster_duplicates(df, threshold)
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    output_csv_path = f'duplicate_clusters_{timestamp}_{uuid.uuid4().hex[:8]}.csv'
+    upload_file_to_container("unique", output_csv_path, result_df.to_csv(index=False))
+
+    response = {
+        "Message": "Files Saved",
+        "Rows": len(df),
+        "Clusters": int(result_df['Cluster_ID'].nunique()),
+        "Duplicate_Rows": int((~result_df['Is_Representative']).sum()),
+        "CSV_FileName": output_csv_path
+    }
+
+    # Deduplicated copy for downstream similarity runs: one row per cluster, in the original order
+    if dedup:
+        dedup_csv_path = f"{os.path.splitext(file1)[0]}{dedup_suffix}"
+        upload_file_to_container("savecsv", dedup_csv_path, df[result_df['Is_Representative'].to_numpy()].to_csv(index=False))
+        response["Dedup_FileName"] = dedup_csv_path
+
+    return response
@@ -7,6 +7,8 @@ from datetime import datetime
 import os
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
+from webhook_dispatcher import dispatch, webhook_url
+from blob_compression import upload_text
 
 app = FastAPI()
 load_dotenv()
@@ -18,6 +20,9 @@ class Progress(BaseModel):
 
 progress = Progress(current_page=0, links_extracted=0, total_links=0)
 
+# Optional Node.js endpoint receiving batched progress events
+progress_webhook_path = os.getenv("WEBHOOK_PROGRESS_PATH")
+
 # Azure Storage connection string
 connect_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 blob_service_client = BlobServiceClient.from_connection_string(connect_str)
@@ -29,8 +34,8 @@ def upload_file_to_container(container_name, file_name, file_content):
 
         print(f"Uploading to Azure Storage as blob:\n\t{file_name}")
 
-        # Upload the created file
-        blob_client.upload_blob(file_content, overwrite=True)
+        # Upload the created file, compressed
+        upload_text(blob_client, file_name, file_content)
 
         print("Upload completed successfully.")
     except Exception as ex:
@@ -134,6 +139,8 @@ def scrape_all_pages(starting_url, base_url):
         all_links.update(new_links)  # Add new links to the set
 
         print(f"Done with {url}. Links extracted: {progress.links_extracted}. Total links: {progress.total_links}")
+        if progress_webhook_path:
+            dispatch(webhook_url(progress_webhook_path), {"site_link": base_url, **progress.model_dump()}, batch=True)
         if next_page_url is None:  # Check if there is no next page URL
             break  # Break out of the loop if no next page URL is found
         url = next_page_url  # Update the URL to the next page
@@ -142,8 +149,7 @@ def scrape_all_pages(starting_url, base_url):
     # Upload the file content to the Azure container
     upload_file_to_container("savelinks", file_name, file_content)
 
-    # Send a webhook notification to the Node.js server
-    webhook_url = "https://nodejs-server-brgrfqfra5bcf5ff.eastus-01.azurewebsites.net/api/webhook/getextractLink"
+    # Queue a webhook notification to the Node.js server
     payload = {
         "message": "Successfully saved links.",
         "respon": {
@@ -151,12 +157,7 @@ def scrape_all_pages(starting_url, base_url):
             "site_link": base_url
         }
     }
-    try:
-        response = requests.post(webhook_url, json=payload)
-        response.raise_for_status()
-        print("Webhook notification sent successfully.")
-    except requests.RequestException as e:
-        print(f"Error sending webhook notification: {e}")
+    dispatch(webhook_url("/api/webhook/getextractLink"), payload)
 
 @app.get("/{encoded_url:path}")
 async def start_scraping(encoded_url: str, background_tasks: BackgroundTasks):
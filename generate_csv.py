@@ -11,6 +11,9 @@ from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
 import io
 from pydantic import BaseModel
+from webhook_dispatcher import dispatch, webhook_url
+from blob_compression import upload_text, download_text
+import browser_pool
 
 app = FastAPI()
 load_dotenv()
@@ -30,6 +33,12 @@ class CsvProgress(BaseModel):
 
 csv_progress = CsvProgress(current_link=0, total_links=0, csv_rows_written=0)
 
+# Optional Node.js endpoint receiving batched progress events
+progress_webhook_path = os.getenv("WEBHOOK_PROGRESS_PATH")
+
+# Columns of the extracted CSV files
+csv_fieldnames = ["Title", "Publish Date", "Meta Description", "Canonical Link", "Article Content", "Yoast Schema Graph"]
+
 # Function to create a session with retries
 def create_session():
     session = requests.Session()
@@ -46,11 +55,17 @@ def create_session():
 
 session = create_session()
 
-# Function to extract content from Bayut
-def extract_content_bayut(url):
-    response = session.get(url)
-    response.encoding = 'utf-8'
-    html_content = response.text
+# Function to render a page in the warm browser pool, or None if rendering fails
+def render_with_browser(url, wait_selector):
+    try:
+        print(f"No static content for {url}, rendering with a headless browser...")
+        return browser_pool.render_page(url, wait_selector)
+    except Exception as e:
+        print(f"Error rendering {url}: {e}")
+        return None
+
+# Function to parse a Bayut article page
+def parse_bayut(html_content):
     soup = BeautifulSoup(html_content, 'html.parser')
 
     title = soup.find('h1', class_='entry-title').text.strip() if soup.find('h1', class_='entry-title') else "no title"
@@ -83,35 +98,61 @@ def extract_content_bayut(url):
 
     return data
 
+# Function to extract content from Bayut
+def extract_content_bayut(url):
+    response = session.get(url)
+    response.encoding = 'utf-8'
+    data = parse_bayut(response.text)
+
+    # Pages rendered client-side only have their content after JavaScript runs
+    if data["Article Content"] == "no content" and browser_pool.rendering_enabled:
+        rendered_html = render_with_browser(url, "article .entry-content")
+        if rendered_html is not None:
+            data = parse_bayut(rendered_html)
+
+    return data
+
+# Function to parse a Property Finder article page
+def parse_property_finder(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    title_tag = soup.find("h1")
+    date_tag = soup.find("p", class_="post-date")
+    content_tag = soup.find(class_="entry-content")
+    meta_description_tag = soup.find("meta", {"name": "description"})
+    canonical_url_tag = soup.find("link", {"rel": "canonical"})
+    yoast_schema_graph_tag = soup.find("script", {"class": "yoast-schema-graph", "type": "application/ld+json"})
+
+    title = title_tag.text.strip() if title_tag else 'N/A'
+    date = date_tag.text.strip() if date_tag else 'N/A'
+    content = content_tag.get_text(strip=True) if content_tag else 'N/A'
+    meta_description = meta_description_tag["content"] if meta_description_tag else 'N/A'
+    canonical_url = canonical_url_tag["href"] if canonical_url_tag else 'N/A'
+    yoast_schema_graph = yoast_schema_graph_tag.string.strip() if yoast_schema_graph_tag else 'N/A'
+
+    data = {
+        "Title": title,
+        "Publish Date": date,
+        "Meta Description": meta_description,
+        "Canonical Link": canonical_url,
+        "Article Content": content,
+        "Yoast Schema Graph": yoast_schema_graph
+    }
+
+    return data
+
 # Function to extract content from Property Finder
 def extract_content_property_finder(url):
     try:
         r = session.get(url, headers={'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'})
         r.raise_for_status()
-        soup = BeautifulSoup(r.text, 'html.parser')
-
-        title_tag = soup.find("h1")
-        date_tag = soup.find("p", class_="post-date")
-        content_tag = soup.find(class_="entry-content")
-        meta_description_tag = soup.find("meta", {"name": "description"})
-        canonical_url_tag = soup.find("link", {"rel": "canonical"})
-        yoast_schema_graph_tag = soup.find("script", {"class": "yoast-schema-graph", "type": "application/ld+json"})
-
-        title = title_tag.text.strip() if title_tag else 'N/A'
-        date = date_tag.text.strip() if date_tag else 'N/A'
-        content = content_tag.get_text(strip=True) if content_tag else 'N/A'
-        meta_description = meta_description_tag["content"] if meta_description_tag else 'N/A'
-        canonical_url = canonical_url_tag["href"] if canonical_url_tag else 'N/A'
-        yoast_schema_graph = yoast_schema_graph_tag.string.strip() if yoast_schema_graph_tag else 'N/A'
+        data = parse_property_finder(r.text)
 
-        data = {
-            "Title": title,
-            "Publish Date": date,
-            "Meta Description": meta_description,
-            "Canonical Link": canonical_url,
-            "Article Content": content,
-            "Yoast Schema Graph": yoast_schema_graph
-        }
+        # Pages rendered client-side only have their content after JavaScript runs
+        if data["Article Content"] == 'N/A' and browser_pool.rendering_enabled:
+            rendered_html = render_with_browser(url, ".entry-content")
+            if rendered_html is not None:
+                data = parse_property_finder(rendered_html)
     except Exception as e:
         print(f"Error processing {url}: {e}")
         data = {
@@ -125,16 +166,24 @@ def extract_content_property_finder(url):
 
     return data
 
+# Function to extract content with the extractor matching the site, or None for other sites
+def extract_content(url):
+    if "bayut.com" in url:
+        return extract_content_bayut(url)
+    elif "propertyfinder.ae" in url:
+        return extract_content_property_finder(url)
+    return None
+
 # Function to download a file from Azure Blob Storage
 def download_file_from_container(container_name, blob_name):
     blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
     try:
         print("Download start...")
-        download_stream = blob_client.download_blob()
+        content = download_text(blob_client)
 
         print("Download complete.")
       
-        return download_stream.content_as_text()
+        return content
     except Exception as ex:
         print(f"Exception: {ex}")
         raise HTTPException(status_code=500, detail="Failed to download file from Azure Storage.")
@@ -143,7 +192,7 @@ def download_file_from_container(container_name, blob_name):
 def upload_file_to_container(container_name, file_name, file_content):
     try:
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
-        blob_client.upload_blob(file_content, overwrite=True)
+        upload_text(blob_client, file_name, file_content)
         print(f"Uploaded {file_name} to {container_name} container.")
     except Exception as ex:
         print(f"Exception: {ex}")
@@ -161,11 +210,8 @@ def generate_csv(formatted_links, file, base_url, refLinkId):
 
     for idx, url in enumerate(formatted_links):
         try:
-            if "bayut.com" in url:
-                data = extract_content_bayut(url)
-            elif "propertyfinder.ae" in url:
-                data = extract_content_property_finder(url)
-            else:
+            data = extract_content(url)
+            if data is None:
                 continue
             all_data.append(data)
         except Exception as e:
@@ -175,11 +221,12 @@ def generate_csv(formatted_links, file, base_url, refLinkId):
         csv_progress.current_link = idx + 1
         csv_progress.csv_rows_written = len(all_data)
         print(f"Processed {csv_progress.current_link}/{csv_progress.total_links} links. Rows written: {csv_progress.csv_rows_written}")
+        if progress_webhook_path:
+            dispatch(webhook_url(progress_webhook_path), {"refLinkId": refLinkId, **csv_progress.model_dump()}, batch=True)
 
     # Create the CSV content
     csv_file = io.StringIO()
-    fieldnames = ["Title", "Publish Date", "Meta Description", "Canonical Link", "Article Content", "Yoast Schema Graph"]
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+    writer = csv.DictWriter(csv_file, fieldnames=csv_fieldnames)
     writer.writeheader()
     writer.writerows(all_data)
     
@@ -189,20 +236,14 @@ def generate_csv(formatted_links, file, base_url, refLinkId):
     # Upload the CSV content to Azure Storage
     upload_file_to_container(savecsv_container, csv_file_name, csv_content)
 
-    # Send a webhook notification to the Node.js server
-    webhook_url = "https://nodejs-server-brgrfqfra5bcf5ff.eastus-01.azurewebsites.net/api/webhook/saveCSVfile"
+    # Queue a webhook notification to the Node.js server
     payload = {
         "Message": "Data extraction and storage complete.",
         "fileName": csv_file_name,
         "refLinkId": refLinkId,
         "refFileName":file
     }
-    try:
-        response = requests.post(webhook_url, json=payload)
-        response.raise_for_status()
-        print("Webhook notification sent successfully.")
-    except requests.RequestException as e:
-        print(f"Error sending webhook notification: {e}")
+    dispatch(webhook_url("/api/webhook/saveCSVfile"), payload)
 
 @app.get("/{file}")
 async def start_csv_generation(file: str, refLinkId: str, background_tasks: BackgroundTasks):
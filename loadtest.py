@@ -0,0 +1,367 @@
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import requests
+from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceExistsError
+from blob_compression import upload_text
+from webhook_receiver import start_receiver
+
+# End-to-end load test of main_app under gunicorn, against Azurite and a local webhook receiver.
+#   python loadtest.py --workers 1,2,4 --clients 16 --duration 60
+# Needs azurite-blob on PATH (npm install -g azurite) unless --connection-string is given.
+
+azurite_connection_string = (
+    "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://127.0.0.1:{port}/devstoreaccount1;"
+)
+
+# Request mixes: endpoint name -> weight
+request_mixes = {
+    "default": {"similar_content": 4, "unique_content": 3, "uniqueFolder": 2, "probe": 1},
+    "read_heavy": {"similar_content": 1, "unique_content": 1, "uniqueFolder": 7, "probe": 1},
+    "compute_heavy": {"similar_content": 5, "unique_content": 4, "uniqueFolder": 0, "probe": 1},
+}
+
+topics = [
+    "Difference between Title Deed and Oqood",
+    "best areas to rent apartments in dubai",
+    "how to apply for a golden visa",
+    "service charges for villas",
+    "buying off plan property in abu dhabi",
+]
+
+vocabulary = (
+    "dubai abu dhabi villa apartment rent buy property title deed oqood visa golden "
+    "service charge mortgage investor freehold community marina downtown palm jumeirah "
+    "tenant landlord contract ejari broker agent payment plan handover off plan ready "
+    "studio bedroom family school beach metro mall price yield market guide tips"
+).split()
+
+
+# Function to find a free local TCP port
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Function to wait until a TCP port accepts connections
+def wait_for_port(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s.")
+
+
+# Function to start Azurite's blob service in a temporary folder
+def start_azurite(data_dir):
+    executable = shutil.which("azurite-blob")
+    if executable is None:
+        sys.exit("azurite-blob not found: install it with 'npm install -g azurite' or pass --connection-string.")
+    port = free_port()
+    process = subprocess.Popen(
+        [executable, "--blobHost", "127.0.0.1", "--blobPort", str(port), "--location", data_dir, "--silent", "--skipApiVersionCheck", "--loose"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port, 30)
+    return process, azurite_connection_string.format(port=port)
+
+
+# Function to generate a synthetic extracted-content CSV
+def synthetic_csv(rng, rows, prefix):
+    fieldnames = ["Title", "Publish Date", "Meta Description", "Canonical Link", "Article Content", "Yoast Schema Graph"]
+    lines = []
+    for i in range(rows):
+        title = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(4, 9)))
+        lines.append({
+            "Title": title,
+            "Publish Date": f"2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+            "Meta Description": " ".join(rng.choice(vocabulary) for _ in range(rng.randint(12, 25))),
+            "Canonical Link": f"https://example.com/{prefix}/{i}",
+            "Article Content": " ".join(rng.choice(vocabulary) for _ in range(rng.randint(80, 200))),
+            "Yoast Schema Graph": "no schema graph",
+        })
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(lines)
+    return output.getvalue()
+
+
+# Function to create the containers and upload the seed corpora
+def seed_blobs(connection_string, rows, seed):
+    rng = random.Random(seed)
+    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+    for container in ("savecsv", "savelinks", "unique"):
+        try:
+            blob_service_client.create_container(container)
+        except ResourceExistsError:
+            pass
+    seeds = [
+        ("savecsv", "loadtest-a.csv", synthetic_csv(rng, rows, "a")),
+        ("savecsv", "loadtest-b.csv", synthetic_csv(rng, rows, "b")),
+        ("unique", "loadtest-unique.csv", synthetic_csv(rng, rows, "u")),
+    ]
+    for container, name, content in seeds:
+        upload_text(blob_service_client.get_blob_client(container=container, blob=name), name, content)
+    print(f"Seeded {len(seeds)} blobs with {rows} rows each.")
+
+
+# Function to build the fixed request sequence for a mix
+def request_plan(mix, total, seed):
+    rng = random.Random(seed)
+    names = [name for name, weight in request_mixes[mix].items() if weight > 0]
+    weights = [request_mixes[mix][name] for name in names]
+    plan = []
+    for _ in range(total):
+        name = rng.choices(names, weights)[0]
+        if name == "similar_content":
+            path = f"/similar_content/loadtest-a.csv/{rng.choice(topics)}?user_id=loadtest"
+        elif name == "unique_content":
+            # Each threshold is cached separately, so the run sees a miss per threshold and hits after that
+            path = f"/unique_content/loadtest-a.csv/loadtest-b.csv?threshold={rng.choice([0.3, 0.5, 0.7])}"
+        elif name == "uniqueFolder":
+            path = "/uniqueFolder/loadtest-unique.csv"
+        else:
+            path = "/healthz"
+        plan.append((name, path))
+    return plan
+
+
+# Function to list the gunicorn worker processes of a master
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == master_pid:
+                pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return pids
+
+
+# Function to read the CPU seconds and resident memory of a process
+def process_usage(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    rss_mb = 0.0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss_mb = int(line.split()[1]) / 1024
+    return cpu_seconds, rss_mb
+
+
+# Samples per-worker CPU and RSS while the load runs
+class WorkerSampler(threading.Thread):
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.first = {}
+        self.last = {}
+        self.max_rss = {}
+
+    def run(self):
+        while not self.stopped.is_set():
+            now = time.time()
+            for pid in worker_pids(self.master_pid):
+                try:
+                    cpu_seconds, rss_mb = process_usage(pid)
+                except OSError:
+                    continue
+                self.first.setdefault(pid, (now, cpu_seconds))
+                self.last[pid] = (now, cpu_seconds)
+                self.max_rss[pid] = max(self.max_rss.get(pid, 0.0), rss_mb)
+            self.stopped.wait(self.interval)
+
+    def report(self):
+        workers = []
+        for pid, (start, cpu_start) in self.first.items():
+            end, cpu_end = self.last[pid]
+            elapsed = max(end - start, 1e-9)
+            workers.append({"pid": pid, "cpu_percent": round(100 * (cpu_end - cpu_start) / elapsed, 1), "max_rss_mb": round(self.max_rss[pid], 1)})
+        return workers
+
+
+# Function to compute a nearest-rank percentile in milliseconds
+def percentile(latencies, p):
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return round(1000 * ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 1)
+
+
+# Function to fire the request plan from a number of client threads
+def run_load(base_url, plan, clients, duration):
+    results = []
+    results_lock = threading.Lock()
+    position = iter(range(len(plan)))
+    position_lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        session = requests.Session()
+        session.headers["Accept-Encoding"] = "gzip"
+        while time.time() < deadline:
+            with position_lock:
+                n = next(position, None)
+            if n is None:
+                return
+            name, path = plan[n]
+            start = time.perf_counter()
+            try:
+                status = session.get(base_url + path, timeout=300).status_code
+            except requests.RequestException:
+                status = 0
+            with results_lock:
+                results.append((name, status, time.perf_counter() - start))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+# Function to summarize latencies and throughput per endpoint
+def summarize(results, elapsed):
+    summary = {}
+    for name in sorted({r[0] for r in results}) + ["all"]:
+        rows = [r for r in results if name == "all" or r[0] == name]
+        latencies = [r[2] for r in rows]
+        summary[name] = {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if not 200 <= r[1] < 300),
+            "throughput_rps": round(len(rows) / elapsed, 2),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+    return summary
+
+
+# Function to run one load test against gunicorn with a given worker count
+def run_scenario(args, workers, connection_string, receiver_url, state_dir):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "AZURE_STORAGE_CONNECTION_STRING": connection_string,
+        "WEBHOOK_BASE_URL": receiver_url,
+        "WEBHOOK_URL": receiver_url + "/api/Webhook/similarContent",
+        "WEBHOOK_OUTBOX_DIR": os.path.join(state_dir, "outbox"),
+        "LSA_INDEX_DIR": os.path.join(state_dir, "lsa"),
+        "CORPUS_LIBRARY_DIR": os.path.join(state_dir, "library"),
+        "CSV_SHARD_DB": os.path.join(state_dir, "shards.sqlite3"),
+    })
+    gunicorn = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "uvicorn.workers.UvicornWorker",
+         "--bind", f"127.0.0.1:{port}", "--timeout", "600", "main:main_app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None, stderr=subprocess.DEVNULL if not args.verbose else None)
+    try:
+        wait_for_port(port, 120)
+        base_url = f"http://127.0.0.1:{port}"
+        requests.get(base_url + "/", timeout=60)  # Every worker has imported the app by now or soon after
+        time.sleep(2)
+
+        sampler = WorkerSampler(gunicorn.pid)
+        sampler.start()
+        plan = request_plan(args.mix, args.requests, args.seed)
+        results, elapsed = run_load(base_url, plan, args.clients, args.duration)
+        sampler.stopped.set()
+        sampler.join()
+    finally:
+        gunicorn.send_signal(signal.SIGTERM)
+        try:
+            gunicorn.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            gunicorn.kill()
+
+    return {
+        "workers": workers,
+        "clients": args.clients,
+        "mix": args.mix,
+        "elapsed_seconds": round(elapsed, 2),
+        "endpoints": summarize(results, elapsed),
+        "worker_usage": sampler.report(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test main_app under gunicorn with local stand-ins.")
+    parser.add_argument("--workers", default="4", help="Comma-separated gunicorn worker counts to compare")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent client threads")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests in the fixed plan")
+    parser.add_argument("--duration", type=float, default=60, help="Stop after this many seconds even if the plan is not done")
+    parser.add_argument("--mix", choices=sorted(request_mixes), default="default")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows per seeded CSV")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--connection-string", default=None, help="Use this blob endpoint instead of starting Azurite")
+    parser.add_argument("--max-probe-p99-ms", type=float, default=None, help="Fail if '/healthz' p99 exceeds this (event-loop blocking check)")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show gunicorn output")
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix="loadtest-")
+    azurite = None
+    try:
+        connection_string = args.connection_string
+        if connection_string is None:
+            azurite, connection_string = start_azurite(os.path.join(state_dir, "azurite"))
+        seed_blobs(connection_string, args.rows, args.seed)
+        receiver = start_receiver()
+        receiver_url = f"http://127.0.0.1:{receiver.server_address[1]}"
+
+        report = []
+        for workers in [int(w) for w in args.workers.split(",")]:
+            print(f"Running {args.mix} mix with {workers} workers and {args.clients} clients...")
+            scenario = run_scenario(args, workers, connection_string, receiver_url, os.path.join(state_dir, f"w{workers}"))
+            report.append(scenario)
+            for name, stats in scenario["endpoints"].items():
+                print(f"  {name:16} {stats['requests']:6} req {stats['errors']:4} err {stats['throughput_rps']:8} rps  p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms  p99 {stats['p99_ms']} ms")
+            for usage in scenario["worker_usage"]:
+                print(f"  worker {usage['pid']}: {usage['cpu_percent']}% CPU, {usage['max_rss_mb']} MB max RSS")
+        receiver.shutdown()
+    finally:
+        if azurite is not None:
+            azurite.terminate()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # '/healthz' is async and does no work, so a slow probe means something is blocking the event loop
+    if args.max_probe_p99_ms is not None:
+        slow = [s["workers"] for s in report if (s["endpoints"].get("probe", {}).get("p99_ms") or 0) > args.max_probe_p99_ms]
+        if slow:
+            print(f"Probe p99 above {args.max_probe_p99_ms} ms with {slow} workers: the event loop is being blocked.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import joblib
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.decomposition import TruncatedSVD
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import normalize
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local directory holding one index per CSV file
+index_dir = os.getenv("LSA_INDEX_DIR", "LsaIndex")
+
+# Number of latent dimensions kept by the SVD
+n_components = int(os.getenv("LSA_COMPONENTS", 256))
+
+# Corpora smaller than this are scanned exactly (a single inverted list)
+min_rows_for_ivf = int(os.getenv("LSA_MIN_ROWS_FOR_IVF", 5000))
+
+# Number of inverted lists probed per query
+default_nprobe = int(os.getenv("LSA_NPROBE", 8))
+
+# Rows embedded per batch when writing the memory-mapped matrix
+transform_batch_size = 10000
+
+# Indexes kept loaded per worker; the least recently used is dropped beyond this
+max_loaded_indexes = int(os.getenv("LSA_MAX_LOADED_INDEXES", 4))
+
+# Indexes already loaded in this worker, keyed by CSV file name, least recently used first
+_loaded_indexes = {}
+_loaded_indexes_lock = threading.Lock()
+
+
+# Function to get the on-disk folder of the index for a CSV file
+def index_path(file_name):
+    return os.path.join(index_dir, os.path.basename(file_name))
+
+
+class LsaIndex:
+    def __init__(self, path):
+        meta_path = os.path.join(path, "meta.json")
+        self.meta_mtime = os.path.getmtime(meta_path)
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.etag = self.meta.get("etag")
+        model = joblib.load(os.path.join(path, "model.joblib"))
+        self.vectorizer = model["vectorizer"]
+        self.svd = model["svd"]
+
+        # Row vectors stay on disk and are paged in on demand
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        self.list_ids = np.load(os.path.join(path, "list_ids.npy"), mmap_mode="r")
+        # CSV rows stay on disk as JSON lines; only the rows of search results are read
+        self.columns = self.meta["columns"]
+        self.rows_path = os.path.join(path, "rows.jsonl")
+        self.row_offsets = np.load(os.path.join(path, "row_offsets.npy"), mmap_mode="r")
+
+    # Function to read CSV rows by row id, as dicts in the given order
+    def read_rows(self, row_ids):
+        rows = []
+        with open(self.rows_path, "rb") as f:
+            for row_id in row_ids:
+                f.seek(self.row_offsets[row_id])
+                rows.append(json.loads(f.read(self.row_offsets[row_id + 1] - self.row_offsets[row_id])))
+        return rows
+
+    # Function to project preprocessed texts into the normalized latent space
+    def embed(self, texts):
+        X = self.vectorizer.transform(texts)
+        Z = self.svd.transform(X)
+        return normalize(Z).astype(np.float32)
+
+    # Function to return the top_k (row, similarity) pairs for a preprocessed query
+    def search(self, query_text, top_k=50, nprobe=default_nprobe):
+        q = self.embed([query_text])[0]
+        if not q.any():  # No known terms in the query
+            return []
+
+        # Pick the closest inverted lists and gather their rows
+        nprobe = min(nprobe, len(self.centroids))
+        probe = np.argsort(self.centroids @ q)[::-1][:nprobe]
+        candidates = np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe])
+        if len(candidates) == 0:
+            return []
+        candidates.sort()  # Sequential reads from the memory map
+
+        sims = self.vectors[candidates] @ q
+        k = min(top_k, len(candidates))
+        best = np.argpartition(-sims, k - 1)[:k]
+        best = best[np.argsort(-sims[best])]
+        return [(int(candidates[i]), float(sims[i])) for i in best]
+
+
+# Function to write the CSV rows as JSON lines with the byte offset of each row
+def write_rows(df, path):
+    row_offsets = [0]
+    with open(os.path.join(path, "rows.jsonl"), "wb") as f:
+        for start in range(0, len(df), transform_batch_size):
+            lines = df.iloc[start:start + transform_batch_size].to_json(orient="records", lines=True)
+            for line in lines.splitlines():
+                data = line.encode("utf-8") + b"\n"
+                f.write(data)
+                row_offsets.append(row_offsets[-1] + len(data))
+    np.save(os.path.join(path, "row_offsets.npy"), np.array(row_offsets, dtype=np.int64))
+
+
+# Function to build and persist the index for a CSV file
+def build_index(file_name, df, texts, etag=None):
+    texts = list(texts)
+    vectorizer = TfidfVectorizer(sublinear_tf=True)
+    X = vectorizer.fit_transform(texts)
+
+    k = min(n_components, X.shape[0] - 1, X.shape[1] - 1)
+    if k < 1:
+        raise ValueError("Not enough rows or terms to build an LSA index.")
+    svd = TruncatedSVD(n_components=k, random_state=0)
+    svd.fit(X)
+    print(f"LSA fitted with {k} components for {file_name}.")
+
+    # Write to a temporary folder first so readers never see a half-built index
+    final_path = index_path(file_name)
+    tmp_path = f"{final_path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    n_rows = X.shape[0]
+    vectors = np.lib.format.open_memmap(os.path.join(tmp_path, "vectors.npy"), mode="w+", dtype=np.float32, shape=(n_rows, k))
+    for start in range(0, n_rows, transform_batch_size):
+        stop = min(start + transform_batch_size, n_rows)
+        vectors[start:stop] = normalize(svd.transform(X[start:stop]))
+    vectors.flush()
+
+    # Inverted file: cluster the vectors and group row ids by cluster
+    if n_rows < min_rows_for_ivf:
+        centroids = normalize(np.asarray(vectors).mean(axis=0, keepdims=True)).astype(np.float32)
+        assignments = np.zeros(n_rows, dtype=np.int64)
+    else:
+        n_lists = min(4096, int(np.sqrt(n_rows)))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=0, n_init=3, batch_size=4096)
+        sample = np.random.default_rng(0).choice(n_rows, size=min(n_rows, 100000), replace=False)
+        kmeans.fit(vectors[np.sort(sample)])
+        centroids = normalize(kmeans.cluster_centers_).astype(np.float32)
+        assignments = np.concatenate([
+            kmeans.predict(vectors[start:start + transform_batch_size])
+            for start in range(0, n_rows, transform_batch_size)
+        ])
+    list_ids = np.argsort(assignments, kind="stable").astype(np.int64)
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))])
+
+    np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_path, "list_ids.npy"), list_ids)
+    np.save(os.path.join(tmp_path, "list_offsets.npy"), list_offsets)
+    joblib.dump({"vectorizer": vectorizer, "svd": svd}, os.path.join(tmp_path, "model.joblib"))
+    write_rows(df, tmp_path)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"file_name": file_name, "etag": etag, "rows": n_rows, "components": k, "lists": len(centroids), "columns": [str(c) for c in df.columns]}, f)
+    del vectors
+
+    shutil.rmtree(final_path, ignore_errors=True)
+    os.rename(tmp_path, final_path)
+    with _loaded_indexes_lock:
+        _loaded_indexes.pop(file_name, None)
+    print(f"LSA index for {file_name} saved to {final_path} ({n_rows} rows, {len(centroids)} lists).")
+
+
+# Function to get the index for a CSV file, loading it once per worker
+def get_index(file_name):
+    path = index_path(file_name)
+    meta_path = os.path.join(path, "meta.json")
+    try:
+        meta_mtime = os.path.getmtime(meta_path)
+    except OSError:
+        with _loaded_indexes_lock:
+            _loaded_indexes.pop(file_name, None)
+        return None
+    with _loaded_indexes_lock:
+        index = _loaded_indexes.pop(file_name, None)
+        if index is not None and index.meta_mtime == meta_mtime:
+            _loaded_indexes[file_name] = index  # Most recently used
+            return index
+
+    # Load outside the lock; a rebuild swapping the folder meanwhile makes the caller fall back to exact search
+    try:
+        index = LsaIndex(path)
+    except Exception as e:
+        print(f"Could not load the LSA index for {file_name}: {e}")
+        return None
+    with _loaded_indexes_lock:
+        _loaded_indexes.pop(file_name, None)
+        _loaded_indexes[file_name] = index
+        while len(_loaded_indexes) > max_loaded_indexes:
+            _loaded_indexes.pop(next(iter(_loaded_indexes)))
+    return index
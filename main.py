@@ -1,19 +1,22 @@
 from similar_content import app as similar_content
 from delete_file import app as delete_file
 from unique_content import app as unique_content
+from corpus_library import app as corpus_library
+from duplicate_clusters import app as duplicate_clusters
 from testCSV import app as testcsv
 from extract_blog_links import app as extract_blog_links
 from extractfilehtml import app as extractFIleHtml
 from fastapi import FastAPI, Request, HTTPException
 from generate_csv import app as generate_csv
+from csv_shards import app as csv_shards, start_workers as start_csv_shard_workers
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.responses import StreamingResponse
 from azure.storage.blob import BlobServiceClient
+from blob_compression import stored_encoding, negotiate_encoding, iter_response_chunks
 from dotenv import load_dotenv
 import os
 import uvicorn
-import io
 load_dotenv()
 main_app = FastAPI()
 
@@ -36,29 +39,51 @@ main_app.add_middleware(
     allow_headers=["*"],  # Or specify specific headers
 )
 
+# Each gunicorn worker also works on leased CSV shards
+@main_app.on_event("startup")
+def start_background_workers():
+    start_csv_shard_workers()
+
 # Root endpoint
 @main_app.get("/")
 def read_root():
     return {"message": "Hello from the main app"}
 
+# Event-loop probe: async and does no work, so it is never queued behind the sync routes' threadpool
+@main_app.get("/healthz")
+async def health_check():
+    return {"status": "ok"}
+
 # Route to fetch files from the unique container
 @main_app.get("/uniqueFolder/{file_name}")
-async def get_unique_file(file_name: str):
+def get_unique_file(file_name: str, request: Request):
     blob_client = blob_service_client.get_blob_client(container=unique_container, blob=file_name)
     try:
-        stream = blob_client.download_blob().readall()
-        return StreamingResponse(io.BytesIO(stream), media_type='application/octet-stream', headers={"Content-Disposition": f"attachment; filename={file_name}"})
+        download_stream = blob_client.download_blob(decompress=False)
     except Exception as ex:
         raise HTTPException(status_code=404, detail=f"File not found: {str(ex)}")
 
+    # Stored compression is passed through when the client accepts it
+    stored = stored_encoding(download_stream.properties)
+    response_encoding = negotiate_encoding(request.headers.get("accept-encoding"), stored)
+    headers = {"Content-Disposition": f"attachment; filename={file_name}", "Vary": "Accept-Encoding"}
+    if response_encoding != "identity":
+        headers["Content-Encoding"] = response_encoding
+    if response_encoding == stored:
+        headers["Content-Length"] = str(download_stream.size)
+    return StreamingResponse(iter_response_chunks(download_stream, stored, response_encoding), media_type='application/octet-stream', headers=headers)
+
 # Mounting sub-applications
 main_app.mount("/similar_content", similar_content)
 main_app.mount("/test", testcsv)
 main_app.mount("/delete_file", delete_file)
 main_app.mount("/unique_content", unique_content)
+main_app.mount("/corpus_library", corpus_library)
+main_app.mount("/duplicate_clusters", duplicate_clusters)
 main_app.mount("/extract_html", extractFIleHtml)
 main_app.mount("/extract_blog_links", extract_blog_links)
 main_app.mount("/generate_csv", generate_csv)
+main_app.mount("/csv_shards", csv_shards)
 
 # Running the application with environment variables for host and port
 # if __name__ == "__main__":
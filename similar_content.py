@@ -10,7 +10,9 @@ from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
 import os
 import io
-import requests
+import lsa_index
+from webhook_dispatcher import dispatch, webhook_url
+from blob_compression import download_text
 
 load_dotenv()
 app = FastAPI()
@@ -39,17 +41,58 @@ def preprocess_text(text):
 def download_file_from_container(container_name, file_name):
     try:
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
-        download_stream = blob_client.download_blob()
-        return download_stream.content_as_text()
+        return download_text(blob_client)
     except Exception as ex:
         print(f"Exception: {ex}")
         raise HTTPException(status_code=500, detail="Failed to download file from Azure Storage.")
 
+# Function to get the ETag of a blob, used to detect stale indexes
+def get_blob_etag(container_name, file_name):
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
+    return blob_client.get_blob_properties().etag
+
+# Function to find similar content using the prebuilt LSA index
+def find_similar_with_index(index, input_topic, top_k):
+    threshold = float(os.getenv("LSA_SIMILARITY_THRESHOLD", 0.5))
+    matches = [(j, similarity) for j, similarity in index.search(preprocess_text(input_topic), top_k=top_k) if similarity > threshold]
+    similar_pairs = []
+    used_titles = set()
+
+    # Only the matched rows are read from disk
+    for (j, similarity), similar_row in zip(matches, index.read_rows([j for j, _ in matches])):
+        if similar_row['Title'] not in used_titles:
+            used_titles.add(similar_row['Title'])
+            similar_pairs.append((input_topic, similarity, similar_row['Title']) + tuple(similar_row[column] for column in index.columns))
+
+    columns = ['Topic', 'Similarity', 'Similar Title'] + index.columns
+    return pd.DataFrame(similar_pairs, columns=columns)
+
+# Function to build the LSA index of a CSV file in the background
+def build_similarity_index(file1: str):
+    try:
+        etag = get_blob_etag(savecsv_container, file1)
+        csv_content = download_file_from_container(savecsv_container, file1)
+        df_extracted = pd.read_csv(io.StringIO(csv_content))
+        texts = (df_extracted['Title'].fillna('') + ' ' + df_extracted['Meta Description'].fillna('')).apply(preprocess_text)
+        lsa_index.build_index(file1, df_extracted, texts, etag=etag)
+    except Exception as e:
+        print(f"Failed to build LSA index for {file1}: {e}")
+
 # Function to process the data and send a webhook notification
-def process_and_notify(file1: str, input_topic: str, user_id: str):
-    webhook_url = os.getenv("WEBHOOK_URL", "https://nodejs-server-brgrfqfra5bcf5ff.eastus-01.azurewebsites.net/api/Webhook/similarContent")
+def process_and_notify(file1: str, input_topic: str, user_id: str, use_index: bool = False, top_k: int = 50):
+    similar_content_webhook_url = os.getenv("WEBHOOK_URL", webhook_url("/api/Webhook/similarContent"))
     
     try:
+        # Answer from the LSA index when one is built for the current version of the file
+        if use_index:
+            index = lsa_index.get_index(file1)
+            if index is not None and index.etag == get_blob_etag(savecsv_container, file1):
+                similar_df = find_similar_with_index(index, input_topic, top_k)
+                result_json = similar_df.to_json(orient='records')
+                dispatch(similar_content_webhook_url, {"result": result_json, "userId": user_id})
+                return
+            print(f"No up-to-date LSA index for {file1}, falling back to exact search.")
+
         # Download the CSV file from Azure Storage
         csv_content_1 = download_file_from_container(savecsv_container, file1)
         
@@ -91,16 +134,22 @@ def process_and_notify(file1: str, input_topic: str, user_id: str):
         # Convert the DataFrame to JSON
         result_json = similar_df.to_json(orient='records')
 
-        # Send the webhook notification including userId
-        response = requests.post(webhook_url, json={"result": result_json, "userId": user_id})
-        response.raise_for_status()
-        print("Webhook notification sent successfully.")
+        # Queue the webhook notification including userId
+        dispatch(similar_content_webhook_url, {"result": result_json, "userId": user_id})
     except Exception as e:
-        print(f"Failed to process data or send webhook: {e}")
-        requests.post(webhook_url, json={"error": str(e), "userId": user_id})
+        print(f"Failed to process data: {e}")
+        dispatch(similar_content_webhook_url, {"error": str(e), "userId": user_id})
+
+@app.post("/index/{file1}")
+async def build_index(file1: str, background_tasks: BackgroundTasks):
+    # Build the LSA index offline; queries keep using exact search until it is ready
+    background_tasks.add_task(build_similarity_index, file1)
+    return {"status": "Indexing started", "message": f"The LSA index for {file1} is being built."}
 
 @app.get("/{file1}/{input_topic}")
-async def read_root(file1: str, input_topic: str, user_id: str, background_tasks: BackgroundTasks):
+async def read_root(file1: str, input_topic: str, user_id: str, background_tasks: BackgroundTasks, use_index: bool = False, top_k: int = 50):
+    if top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1.")
     # Start the processing in the background and notify via webhook
-    background_tasks.add_task(process_and_notify, file1, input_topic, user_id)
+    background_tasks.add_task(process_and_notify, file1, input_topic, user_id, use_index, top_k)
     return {"status": "Processing started", "message": "The results will be sent to the Node.js server when done."}
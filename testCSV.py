@@ -5,6 +5,7 @@ import datetime
 from azure.storage.blob import BlobServiceClient
 from io import StringIO
 from dotenv import load_dotenv
+from blob_compression import upload_text
 app = FastAPI()
 load_dotenv()
 # Azure Storage connection string
@@ -18,7 +19,7 @@ savecsv_container = "savecsv"
 def upload_file_to_container(container_name, file_name, file_content):
     try:
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
-        blob_client.upload_blob(file_content, overwrite=True)
+        upload_text(blob_client, file_name, file_content)
         print(f"Uploaded {file_name} to {container_name} container.")
     except Exception as ex:
         print(f"Exception: {ex}")
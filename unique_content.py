@@ -1,15 +1,23 @@
 import os
+import json
+import hashlib
+import tempfile
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import nltk
 from nltk.corpus import stopwords
 import string
 import re
-from fastapi import FastAPI, HTTPException
-from datetime import datetime
-from azure.storage.blob import BlobServiceClient
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from datetime import datetime, timedelta, timezone
+from azure.storage.blob import BlobServiceClient, BlobBlock, ContentSettings
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
 from dotenv import load_dotenv
+from blob_compression import upload_text, download_text, iter_decompressed_chunks, compressor_for, content_type_for, upload_encoding
 import io
 
 app = FastAPI()
@@ -23,6 +31,24 @@ stop_words = set(stopwords.words('english'))
 connect_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 blob_service_client = BlobServiceClient.from_connection_string(connect_str)
 
+# Rows held in memory per CSV chunk in streaming mode
+stream_chunk_rows = int(os.getenv("UNIQUE_STREAM_CHUNK_ROWS", 5000))
+
+# Output is staged to Azure in blocks of roughly this many bytes
+stream_block_bytes = 4 * 1024 * 1024
+
+# Cached results are evicted after this long
+cache_ttl = timedelta(hours=float(os.getenv("UNIQUE_CACHE_TTL_HOURS", 168)))
+
+# Running jobs older than this are assumed dead and restarted
+job_timeout = timedelta(minutes=float(os.getenv("UNIQUE_JOB_TIMEOUT_MINUTES", 60)))
+
+# Prefix of the cache entries kept next to the outputs in the 'unique' container
+cache_prefix = "cache/"
+
+# Stateless vectorizer shared by every streaming pass
+hashing_vectorizer = HashingVectorizer(n_features=2 ** 20, alternate_sign=False, norm=None)
+
 # Function for text preprocessing
 def preprocess_text(text):
     if pd.isna(text):  # Check for NaN values
@@ -38,7 +64,7 @@ def preprocess_text(text):
 def upload_file_to_container(container_name, file_name, file_content):
     try:
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
-        blob_client.upload_blob(file_content, overwrite=True)
+        upload_text(blob_client, file_name, file_content)
         print(f"Uploaded {file_name} to {container_name} container.")
     except Exception as ex:
         print(f"Exception: {ex}")
@@ -48,14 +74,150 @@ def upload_file_to_container(container_name, file_name, file_content):
 def download_file_from_container(container_name, file_name):
     try:
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
-        download_stream = blob_client.download_blob()
-        return download_stream.content_as_text()
+        return download_text(blob_client)
     except Exception as ex:
         print(f"Exception: {ex}")
         raise HTTPException(status_code=500, detail="Failed to download file from Azure Storage.")
 
-@app.get("/{file1}/{file2}")
-async def reat_root(file1: str, file2: str):
+# File-like wrapper over the byte chunks of a blob download
+class BlobChunkReader(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+# Function to read a CSV blob chunk by chunk with its preprocessed text column
+def iter_csv_chunks(container_name, file_name, chunk_rows=stream_chunk_rows):
+    try:
+        blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
+        download_stream = blob_client.download_blob(decompress=False)
+    except Exception as ex:
+        print(f"Exception: {ex}")
+        raise HTTPException(status_code=500, detail="Failed to download file from Azure Storage.")
+
+    text_stream = io.TextIOWrapper(io.BufferedReader(BlobChunkReader(iter_decompressed_chunks(download_stream))), encoding="utf-8")
+    for df in pd.read_csv(text_stream, chunksize=chunk_rows):
+        df['Processed_Text'] = (df['Title'].fillna('') + ' ' + df['Meta Description'].fillna('')).apply(preprocess_text)
+        yield df
+
+# Writes text to a block blob in staged, compressed blocks, committing on close
+class BlockBlobWriter:
+    def __init__(self, container_name, file_name):
+        self.blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
+        self.file_name = file_name
+        self.compressor = compressor_for(upload_encoding)
+        self.block_ids = []
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.buffer.append(data)
+        self.buffered_bytes += len(data)
+        if self.buffered_bytes >= stream_block_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        block_id = f"{len(self.block_ids):08d}"
+        self.blob_client.stage_block(block_id=block_id, data=b"".join(self.buffer))
+        self.block_ids.append(block_id)
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def close(self):
+        if self.compressor is not None:
+            self.buffer.append(self.compressor.flush())
+        self.flush()
+        content_settings = ContentSettings(
+            content_type=content_type_for(self.file_name),
+            content_encoding=None if upload_encoding == "identity" else upload_encoding,
+        )
+        self.blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in self.block_ids], content_settings=content_settings)
+        print(f"Uploaded {self.file_name} in {len(self.block_ids)} blocks.")
+
+# Function to weight hashed term counts with IDF and L2-normalize the rows
+def tfidf_transform(texts, idf):
+    X = hashing_vectorizer.transform(texts) @ sp.diags(idf)
+    norms = np.sqrt(X.multiply(X).sum(axis=1)).A1
+    norms[norms == 0] = 1.0
+    return sp.csr_matrix(sp.diags(1.0 / norms) @ X)
+
+# Function to find unique content with bounded memory, streaming both files in chunks
+def stream_unique_content(file1, file2, output_csv_path, output_json_path, threshold=0.5):
+    # Pass 1: document frequencies of file1, like fitting the vectorizer on df1
+    print("Streaming pass 1: document frequencies...")
+    doc_freq = np.zeros(hashing_vectorizer.n_features, dtype=np.int64)
+    n_docs = 0
+    for df1 in iter_csv_chunks("savecsv", file1):
+        counts = hashing_vectorizer.transform(df1['Processed_Text'])
+        doc_freq += np.bincount(counts.indices, minlength=hashing_vectorizer.n_features)
+        n_docs += len(df1)
+    idf = np.log((1 + n_docs) / (1 + doc_freq)) + 1
+    idf[doc_freq == 0] = 0  # Terms absent from file1 are outside its vocabulary
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        # Pass 2: vectorize file2 once and spool its chunks to local disk
+        print("Streaming pass 2: vectorizing reference file...")
+        spooled_chunks = []
+        for n, df2 in enumerate(iter_csv_chunks("savecsv", file2)):
+            path = os.path.join(spool_dir, f"chunk-{n}.npz")
+            sp.save_npz(path, tfidf_transform(df2['Processed_Text'], idf))
+            spooled_chunks.append(path)
+
+        # Pass 3: per-row max similarity of file1 against every spooled chunk
+        print("Streaming pass 3: comparing chunks...")
+        csv_writer = BlockBlobWriter("unique", output_csv_path)
+        json_writer = BlockBlobWriter("unique", output_json_path)
+        header_written = False
+        unique_count = 0
+        columns = []
+        for df1 in iter_csv_chunks("savecsv", file1):
+            columns = list(df1.columns)
+            X_df1 = tfidf_transform(df1['Processed_Text'], idf)
+            max_similarity = np.zeros(len(df1))
+            for path in spooled_chunks:
+                X_df2 = sp.load_npz(path)
+                similarity = (X_df1 @ X_df2.T).max(axis=1).toarray().ravel()
+                np.maximum(max_similarity, similarity, out=max_similarity)
+
+            is_unique = max_similarity < threshold
+            if not is_unique.any():
+                continue
+            unique_df = df1[is_unique].copy()
+            unique_df['Uniqueness_Score'] = 1 - max_similarity[is_unique]
+            unique_count += len(unique_df)
+
+            csv_writer.write(unique_df.to_csv(index=False, header=not header_written))
+            json_lines = unique_df.to_json(orient='records', lines=True)
+            json_writer.write(json_lines if json_lines.endswith("\n") else json_lines + "\n")
+            header_written = True
+
+        if not header_written:
+            csv_writer.write(pd.DataFrame(columns=columns + ['Uniqueness_Score']).to_csv(index=False))
+        csv_writer.close()
+        json_writer.close()
+
+    print(f"Streaming comparison done: {unique_count} unique rows.")
+
+# Function to find unique content of file1 compared to file2 and upload the results
+def find_unique_content(file1, file2, output_csv_path, output_json_path, threshold=0.5):
     # Download the CSV files from Azure Storage
     print("Downloading CSV files from Azure Storage...")
     csv_content_1 = download_file_from_container("savecsv", file1)
@@ -85,7 +247,6 @@ async def reat_root(file1: str, file2: str):
     print("Cosine similarity calculated.")
 
     # Find unique blogs in df1 not similar to any blogs in df2 and calculate their uniqueness score
-    threshold = 0.5  # Adjust the threshold as needed
     unique_rows = []
     uniqueness_scores = []
 
@@ -99,11 +260,6 @@ async def reat_root(file1: str, file2: str):
     unique_df = pd.DataFrame(unique_rows)
     unique_df['Uniqueness_Score'] = uniqueness_scores
 
-    # Generate a unique file name with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    output_csv_path = f'unique_content_{timestamp}.csv'
-    output_json_path = f'unique_content_{timestamp}.json'
-
     # Create CSV and JSON content
     csv_content = unique_df.to_csv(index=False)
     json_content = unique_df.to_json(orient='records', lines=True)
@@ -114,8 +270,120 @@ async def reat_root(file1: str, file2: str):
 
     print(f"Unique content saved to Azure container 'unique' as '{output_csv_path}' and '{output_json_path}'.")
 
-    return {
-        "Message": "Files Saved",
-        "CSV_FileName": output_csv_path,
-        "JSON_FileName": output_json_path
+# Function to read a cache entry and its blob ETag, or (None, None) if there is none
+def read_cache_entry(job_id):
+    blob_client = blob_service_client.get_blob_client(container="unique", blob=f"{cache_prefix}{job_id}.json")
+    try:
+        download_stream = blob_client.download_blob()
+        return json.loads(download_stream.readall()), download_stream.properties.etag
+    except ResourceNotFoundError:
+        return None, None
+
+# Function to write a cache entry; with create_only or if_match, fails if another worker already claimed it
+def write_cache_entry(job_id, entry, create_only=False, if_match=None):
+    blob_client = blob_service_client.get_blob_client(container="unique", blob=f"{cache_prefix}{job_id}.json")
+    if if_match is not None:
+        blob_client.upload_blob(json.dumps(entry), overwrite=True, etag=if_match, match_condition=MatchConditions.IfNotModified)
+    else:
+        blob_client.upload_blob(json.dumps(entry), overwrite=not create_only)
+
+# Function to delete a cache entry together with the outputs it points to
+def delete_cache_entry(job_id, entry):
+    for file_name in (entry.get("CSV_FileName"), entry.get("JSON_FileName"), f"{cache_prefix}{job_id}.json"):
+        if not file_name:
+            continue
+        try:
+            blob_service_client.get_blob_client(container="unique", blob=file_name).delete_blob()
+        except ResourceNotFoundError:
+            pass
+    print(f"Evicted cached result {job_id}.")
+
+# Function to evict entries of the same file pair computed from older inputs, and expired entries
+def evict_stale_entries(pair_hash=None, current_etags=None):
+    container_client = blob_service_client.get_container_client("unique")
+    now = datetime.now(timezone.utc)
+    prefix = f"{cache_prefix}{pair_hash}-" if pair_hash else cache_prefix
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        expired = now - blob.last_modified >= cache_ttl
+        if pair_hash is None and not expired:
+            continue
+        job_id = blob.name[len(cache_prefix):-len(".json")]
+        entry, _ = read_cache_entry(job_id)
+        if entry is None or entry["status"] == "running":
+            continue
+        # Entries of the pair at other thresholds stay valid while the inputs are unchanged
+        outdated = pair_hash is not None and entry.get("etags") not in (None, current_etags)
+        if expired or outdated:
+            delete_cache_entry(job_id, entry)
+
+# Function to run a comparison job and record its outcome in the cache entry
+def run_unique_job(job_id, entry):
+    try:
+        if entry["stream"]:
+            stream_unique_content(entry["file1"], entry["file2"], entry["CSV_FileName"], entry["JSON_FileName"], entry["threshold"])
+        else:
+            find_unique_content(entry["file1"], entry["file2"], entry["CSV_FileName"], entry["JSON_FileName"], entry["threshold"])
+        entry["status"] = "done"
+    except Exception as e:
+        print(f"Unique content job {job_id} failed: {e}")
+        entry["status"] = "failed"
+        entry["error"] = str(e.detail if isinstance(e, HTTPException) else e)
+    entry["finished"] = datetime.now(timezone.utc).isoformat()
+    write_cache_entry(job_id, entry)
+    evict_stale_entries()
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    entry, _ = read_cache_entry(job_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"job_id": job_id, **entry}
+
+@app.get("/{file1}/{file2}")
+def reat_root(file1: str, file2: str, background_tasks: BackgroundTasks, threshold: float = 0.5, stream: bool = False):
+    # Results are keyed by the ETags of both inputs, so a changed file never hits an old result
+    try:
+        etag1 = blob_service_client.get_blob_client(container="savecsv", blob=file1).get_blob_properties().etag
+        etag2 = blob_service_client.get_blob_client(container="savecsv", blob=file2).get_blob_properties().etag
+    except ResourceNotFoundError:
+        raise HTTPException(status_code=404, detail="CSV file not found in Azure Storage.")
+    pair_hash = hashlib.sha1(f"{file1}|{file2}".encode()).hexdigest()[:16]
+    key_hash = hashlib.sha1(f"{etag1}|{etag2}|{threshold}|{stream}".encode()).hexdigest()[:16]
+    job_id = f"{pair_hash}-{key_hash}"
+
+    entry, entry_etag = read_cache_entry(job_id)
+    if entry is not None and entry["status"] == "done":
+        csv_blob = blob_service_client.get_blob_client(container="unique", blob=entry["CSV_FileName"])
+        if csv_blob.exists():
+            return {
+                "Message": "Files Saved",
+                "CSV_FileName": entry["CSV_FileName"],
+                "JSON_FileName": entry["JSON_FileName"],
+                "Cached": True
+            }
+    if entry is not None and entry["status"] == "running":
+        if datetime.now(timezone.utc) - datetime.fromisoformat(entry["started"]) < job_timeout:
+            return {"status": "Task running", "job_id": job_id, "message": "The comparison is already in progress."}
+
+    # Cache miss: claim the job and run it in the background
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    new_entry = {
+        "status": "running",
+        "file1": file1,
+        "file2": file2,
+        "threshold": threshold,
+        "stream": stream,
+        "etags": [etag1, etag2],
+        "CSV_FileName": f'unique_content_{timestamp}_{key_hash[:8]}.csv',
+        "JSON_FileName": f'unique_content_{timestamp}_{key_hash[:8]}.json',
+        "started": datetime.now(timezone.utc).isoformat()
     }
+    # Only one of several concurrent requests wins the claim: the entry must be unchanged since it was read
+    try:
+        write_cache_entry(job_id, new_entry, create_only=entry is None, if_match=entry_etag)
+    except (ResourceExistsError, ResourceModifiedError):
+        return {"status": "Task running", "job_id": job_id, "message": "The comparison is already in progress."}
+    evict_stale_entries(pair_hash, new_entry["etags"])
+    background_tasks.add_task(run_unique_job, job_id, new_entry)
+
+    return {"status": "Task started", "job_id": job_id, "message": f"Poll /unique_content/jobs/{job_id} for the result."}
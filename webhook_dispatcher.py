@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import queue
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Base URL of the Node.js server; point it at webhook_receiver.py to test locally
+webhook_base_url = os.getenv("WEBHOOK_BASE_URL", "https://nodejs-server-brgrfqfra5bcf5ff.eastus-01.azurewebsites.net")
+
+# Events are written here before sending and removed once delivered
+outbox_dir = os.getenv("WEBHOOK_OUTBOX_DIR", "WebhookOutbox")
+
+# Events that were rejected or ran out of attempts are moved here and never replayed
+dead_letter_dir = os.path.join(outbox_dir, "dead")
+
+request_timeout = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", 10))
+max_attempts = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 5))
+backoff_seconds = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", 0.5))
+batch_seconds = float(os.getenv("WEBHOOK_BATCH_SECONDS", 2))
+replay_seconds = float(os.getenv("WEBHOOK_REPLAY_SECONDS", 60))
+
+
+# Function to build a webhook URL on the Node.js server
+def webhook_url(path):
+    return webhook_base_url.rstrip("/") + path
+
+
+# Function to create a pooled HTTP session; retries are handled by the dispatcher
+def create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Function to check whether the worker owning an outbox file is still running
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WebhookDispatcher:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.session = create_session()
+        self.pid = os.getpid()
+        self.retries = []  # Heap of (due time, sequence, delivery)
+        self.batches = {}  # url -> (flush time, [events])
+        self.sequence = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    # Function to queue an event; returns immediately with the event id
+    def dispatch(self, url, payload, batch=False):
+        event = {"id": uuid.uuid4().hex, "url": url, "payload": payload, "batch": batch, "created": time.time()}
+        self.start()  # Picks up this worker's pid after a fork, before the outbox file is named
+        self.write_outbox(event)
+        self.queue.put(event)
+        return event["id"]
+
+    # Function to start the delivery thread on first use (after gunicorn has forked)
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name="webhook-dispatcher", daemon=True)
+            self.thread.start()
+
+    def outbox_path(self, event_id):
+        return os.path.join(outbox_dir, f"{event_id}.{self.pid}.json")
+
+    def write_outbox(self, event):
+        os.makedirs(outbox_dir, exist_ok=True)
+        tmp_path = self.outbox_path(event["id"]) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(event, f)
+        os.replace(tmp_path, self.outbox_path(event["id"]))
+
+    def remove_outbox(self, event_ids):
+        for event_id in event_ids:
+            try:
+                os.remove(self.outbox_path(event_id))
+            except FileNotFoundError:
+                pass
+
+    # Function to move undeliverable events out of the outbox, recording why they failed
+    def dead_letter(self, delivery, error):
+        os.makedirs(dead_letter_dir, exist_ok=True)
+        for event_id in delivery["event_ids"]:
+            try:
+                with open(self.outbox_path(event_id)) as f:
+                    event = json.load(f)
+            except (OSError, ValueError):
+                continue
+            event.update(error=str(error), attempts=delivery["attempts"], failed=time.time())
+            dead_path = os.path.join(dead_letter_dir, f"{event_id}.json")
+            with open(dead_path + ".tmp", "w") as f:
+                json.dump(event, f)
+            os.replace(dead_path + ".tmp", dead_path)
+        self.remove_outbox(delivery["event_ids"])
+
+    # Function to re-queue undelivered events of this worker and events left by dead workers
+    def replay_outbox(self, pending_ids):
+        if not os.path.isdir(outbox_dir):
+            return
+        for file_name in os.listdir(outbox_dir):
+            parts = file_name.split(".")
+            if len(parts) != 3 or parts[2] != "json":
+                continue
+            path = os.path.join(outbox_dir, file_name)
+            try:
+                event_id, pid = parts[0], int(parts[1])
+                if pid == self.pid:
+                    # Skip events still queued or retrying, and ones written moments ago
+                    if event_id in pending_ids or time.time() - os.path.getmtime(path) < replay_seconds:
+                        continue
+                elif pid_alive(pid):
+                    continue
+                else:
+                    # Claim the dead worker's event; only one worker wins the rename
+                    os.rename(path, self.outbox_path(event_id))
+                with open(self.outbox_path(event_id)) as f:
+                    event = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self.schedule({"url": event["url"], "payload": event["payload"], "event_ids": [event_id], "attempts": 0}, 0)
+
+    def schedule(self, delivery, delay):
+        self.sequence += 1
+        heapq.heappush(self.retries, (time.time() + delay, self.sequence, delivery))
+
+    # Function to send one delivery, scheduling a retry with exponential backoff on failure
+    def deliver(self, delivery):
+        try:
+            response = self.session.post(delivery["url"], json=delivery["payload"], timeout=request_timeout)
+            response.raise_for_status()
+            self.remove_outbox(delivery["event_ids"])
+            print(f"Webhook notification sent successfully to {delivery['url']}.")
+        except requests.RequestException as e:
+            delivery["attempts"] += 1
+            status = e.response.status_code if e.response is not None else None
+            # Client errors other than timeout and rate limiting will not succeed on retry
+            rejected = status is not None and 400 <= status < 500 and status not in (408, 429)
+            if not rejected and delivery["attempts"] < max_attempts:
+                delay = backoff_seconds * 2 ** (delivery["attempts"] - 1) * random.uniform(0.8, 1.2)
+                print(f"Webhook to {delivery['url']} failed ({e}), retrying in {delay:.1f}s.")
+                self.schedule(delivery, delay)
+            else:
+                print(f"Webhook to {delivery['url']} failed after {delivery['attempts']} attempts, moved to {dead_letter_dir}: {e}")
+                self.dead_letter(delivery, e)
+
+    def run(self):
+        # Events left behind by a previous process are delivered first
+        self.replay_outbox(set())
+        next_replay = time.time() + replay_seconds
+        while True:
+            now = time.time()
+            due_times = [next_replay] + [flush_at for flush_at, _ in self.batches.values()]
+            if self.retries:
+                due_times.append(self.retries[0][0])
+            try:
+                event = self.queue.get(timeout=max(0.0, min(due_times) - now))
+                if event["batch"]:
+                    flush_at, events = self.batches.setdefault(event["url"], (now + batch_seconds, []))
+                    events.append(event)
+                else:
+                    self.deliver({"url": event["url"], "payload": event["payload"], "event_ids": [event["id"]], "attempts": 0})
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            for url, (flush_at, events) in list(self.batches.items()):
+                if flush_at <= now:
+                    del self.batches[url]
+                    self.deliver({"url": url, "payload": {"events": [e["payload"] for e in events]}, "event_ids": [e["id"] for e in events], "attempts": 0})
+            while self.retries and self.retries[0][0] <= now:
+                _, _, delivery = heapq.heappop(self.retries)
+                self.deliver(delivery)
+            if next_replay <= now:
+                pending_ids = {event_id for _, _, delivery in self.retries for event_id in delivery["event_ids"]}
+                pending_ids.update(e["id"] for _, events in self.batches.values() for e in events)
+                pending_ids.update(e["id"] for e in list(self.queue.queue))
+                self.replay_outbox(pending_ids)
+                next_replay = now + replay_seconds
+
+
+dispatcher = WebhookDispatcher()
+
+
+# Function to send a webhook without blocking the caller
+def dispatch(url, payload, batch=False):
+    return dispatcher.dispatch(url, payload, batch)
@@ -0,0 +1,65 @@
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the Node.js webhook server.
+# Run the app with WEBHOOK_BASE_URL=http://127.0.0.1:<port> to deliver here.
+
+
+class ReceiverState:
+    def __init__(self, fail_first=0, delay=0.0, log_file=None):
+        self.fail_first = fail_first
+        self.delay = delay
+        self.log_file = log_file
+        self.received = 0
+        self.lock = threading.Lock()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    state = ReceiverState()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        state = self.state
+        if state.delay:
+            time.sleep(state.delay)
+
+        with state.lock:
+            state.received += 1
+            failing = state.received <= state.fail_first
+            if not failing and state.log_file:
+                with open(state.log_file, "a") as f:
+                    f.write(json.dumps({"path": self.path, "time": time.time(), "body": json.loads(body or b"null")}) + "\n")
+
+        self.send_response(503 if failing else 200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"ok": false}' if failing else b'{"ok": true}')
+        print(f"{'Rejected' if failing else 'Received'} webhook {self.path} ({len(body)} bytes)")
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to start the receiver in a background thread and return the server
+def start_receiver(host="127.0.0.1", port=0, fail_first=0, delay=0.0, log_file=None):
+    handler = type("Handler", (WebhookHandler,), {"state": ReceiverState(fail_first, delay, log_file)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Node.js webhook server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer 503 to the first N requests")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--log-file", default=None, help="Append received events to this JSON-lines file")
+    args = parser.parse_args()
+
+    WebhookHandler.state = ReceiverState(args.fail_first, args.delay, args.log_file)
+    print(f"Webhook receiver listening on http://{args.host}:{args.port}")
+    ThreadingHTTPServer((args.host, args.port), WebhookHandler).serve_forever()